@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite
+Times the pipeline stages on synthetic data from sample_matches.py and saves the
+results as JSON, so runs can be compared over time
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import tennis_serve_analyzer as analyzer
+import update_data
+from sample_matches import generate_sample_matches
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)  # Player performances (two per match)
+OUTPUT_DIR = Path(__file__).resolve().parent / '.cache' / 'benchmarks'
+
+# simulate_match_outcome is timed one call at a time, on at most this many performances
+MAX_SINGLE_CALLS = 2_000
+
+def benchmark_data(performances, seed=42):
+    """Synthetic matches (sample_matches generator) giving about `performances` player performances"""
+    df = generate_sample_matches(max(performances // 2, 1), seed=seed)
+    df['tour'] = 'ATP'
+    df['tourney_id'] = '2024-' + df['tourney_name'].str.replace(' ', '-').str.lower()
+    df['match_num'] = np.arange(len(df))
+    df['score'] = '6-4 6-4'
+    return df
+
+def measure(func, memory=True):
+    """
+    Run func() and return (result, wall seconds, peak MB).
+
+    Wall time comes from a plain run; with memory=True the function is run a
+    second time under tracemalloc for the peak, since tracing slows Python code.
+    stdout is discarded (the stages print progress).
+    """
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func()
+        wall = time.perf_counter() - start
+
+    peak_mb = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+    return result, wall, peak_mb
+
+def run_size(size, memory=True):
+    """Time every stage on one dataset size; returns a list of result rows"""
+    df = benchmark_data(size)
+    rows = []
+
+    def record(stage, performances, wall, peak_mb):
+        rows.append({
+            'stage': stage,
+            'size': size,
+            'performances': performances,
+            'wall_s': round(wall, 6),
+            'throughput': round(performances / wall, 1) if wall > 0 else None,
+            'peak_mb': round(peak_mb, 2) if peak_mb is not None else None,
+        })
+        memory_text = f"{peak_mb:9.1f}MB" if peak_mb is not None else ''
+        print(f"  {stage:<38} {performances:>10,} {wall:10.3f}s {performances / wall:14,.0f}/s {memory_text}")
+
+    # Single-call simulation on the first performances of the set
+    sample = df.head(max(MAX_SINGLE_CALLS // 2, 1))
+    calls = [(row.w_1stIn / row.w_svpt, row.w_1stWon / row.w_1stIn,
+              row.w_2ndWon / (row.w_svpt - row.w_1stIn), row.w_svpt)
+             for row in sample.itertuples()] * 2
+    calls = calls[:min(size, MAX_SINGLE_CALLS)]
+    _, wall, peak = measure(lambda: [analyzer.simulate_match_outcome(fi, fw, sw, svpt) for fi, fw, sw, svpt in calls],
+                            memory)
+    record('simulate_match_outcome', len(calls), wall, peak)
+
+    results_df, wall, peak = measure(lambda: analyzer.calculate_serve_advantage(df), memory)
+    record('calculate_serve_advantage', len(results_df), wall, peak)
+
+    _, wall, peak = measure(lambda: analyzer.analyze_results(results_df.copy()), memory)
+    record('analyze_results', len(results_df), wall, peak)
+    del results_df
+
+    records, wall, peak = measure(lambda: update_data.calculate_serve_advantage(df), memory)
+    record('update_data.calculate_serve_advantage', len(records), wall, peak)
+
+    with tempfile.TemporaryDirectory() as site_dir:
+        _, wall, peak = measure(lambda: update_data.update_html(records, site_dir), memory)
+    record('update_html', len(records), wall, peak)
+
+    return rows
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Print each stage's wall time relative to a previous results file"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    before = {(row['stage'], row['size']): row for row in baseline['results']}
+    print(f"\nCompared with {baseline_path} ({baseline.get('revision') or 'unknown revision'}):")
+    for row in results:
+        old = before.get((row['stage'], row['size']))
+        if old is None or not old['wall_s']:
+            continue
+        ratio = row['wall_s'] / old['wall_s']
+        print(f"  {row['stage']:<38} {row['size']:>10,} {old['wall_s']:10.3f}s -> {row['wall_s']:10.3f}s  ({ratio:.2f}x)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the analysis pipeline stages on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES),
+                        help=f"number of player performances per run (default: {' '.join(map(str, SIZES))})")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the tracemalloc run of each stage (halves the run time)")
+    parser.add_argument('--output', type=Path,
+                        help=f"results file (default: {OUTPUT_DIR}/<timestamp>.json)")
+    parser.add_argument('--compare', type=Path,
+                        help="previous results file to compare wall times against")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    started = datetime.now(timezone.utc)
+
+    print("="*60)
+    print("TENNIS SERVE ANALYZER - BENCHMARK")
+    print("="*60)
+
+    results = []
+    for size in args.sizes:
+        print(f"\n{size:,} performances:")
+        results.extend(run_size(size, memory=not args.no_memory))
+
+    report = {
+        'started': started.isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'engine': analyzer.SIM_ENGINE,
+        'num_simulations': analyzer.NUM_SIMULATIONS,
+        'results': results,
+    }
+    output = args.output or OUTPUT_DIR / f"{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\n✓ Results saved to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Download Cache
+Local copies of the yearly match CSVs, revalidated with conditional GET,
+plus a binary cache of the parsed frames and the columns and dtypes they're
+loaded with
+"""
+
+import hashlib
+import http.client
+import importlib.util
+import json
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / '.cache' / 'downloads'
+DEFAULT_PARSED_DIR = Path(__file__).resolve().parent / '.cache' / 'parsed'
+
+# Parsed frames are stored as Parquet when pyarrow is installed, otherwise as pickles
+PARSED_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') else 'pkl'
+
+DEFAULT_WORKERS = 8  # Concurrent downloads, and so at most this many open connections per host
+DEFAULT_RETRIES = 3
+
+# Responses worth retrying; anything else (e.g. 404 for a year not published yet) fails at once
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Columns the analysis reads from Sackmann match files, with compact dtypes.
+# Counts are nullable integers (stats are missing for some matches); repeated
+# strings are categoricals. Everything else in the ~49-column files is skipped.
+MATCH_DTYPES = {
+    'tourney_id': 'category',
+    'tourney_name': 'category',
+    'surface': 'category',
+    'tourney_level': 'category',
+    'tourney_date': 'Int32',
+    'match_num': 'Int16',
+    'winner_name': 'category',
+    'loser_name': 'category',
+    'score': str,
+    'best_of': 'Int8',
+    'round': 'category',
+    'w_svpt': 'Int16', 'w_1stIn': 'Int16', 'w_1stWon': 'Int16', 'w_2ndWon': 'Int16',
+    'l_svpt': 'Int16', 'l_1stIn': 'Int16', 'l_1stWon': 'Int16', 'l_2ndWon': 'Int16',
+}
+
+class DownloadError(Exception):
+    def __init__(self, url, status):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+
+# Each worker thread keeps one keep-alive connection per host
+_local = threading.local()
+
+def _connection(scheme, netloc, timeout):
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get((scheme, netloc))
+    if conn is None:
+        conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = connections[(scheme, netloc)] = conn_class(netloc, timeout=timeout)
+    return conn
+
+def _drop_connection(scheme, netloc):
+    conn = getattr(_local, 'connections', {}).pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+def _get(url, headers, timeout, redirects=5):
+    """GET over the thread's pooled connection; returns (status, headers, body)"""
+    parts = urllib.parse.urlsplit(url)
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    conn = _connection(parts.scheme, parts.netloc, timeout)
+    try:
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+    except (http.client.HTTPException, OSError):
+        _drop_connection(parts.scheme, parts.netloc)
+        raise
+    if response.will_close:
+        _drop_connection(parts.scheme, parts.netloc)
+
+    if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+        location = urllib.parse.urljoin(url, response.headers['Location'])
+        return _get(location, headers, timeout, redirects - 1)
+    return response.status, response.headers, body
+
+def cache_paths(url, cache_dir):
+    """(data file, metadata file) for a URL; the name keeps the CSV basename for readability"""
+    url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+    name = url.rstrip('/').rsplit('/', 1)[-1] or 'index'
+    data_path = Path(cache_dir) / f"{url_hash}-{name}"
+    return data_path, data_path.with_name(data_path.name + '.meta.json')
+
+def _write_atomic(path, data):
+    tmp_path = path.with_name(path.name + f'.{threading.get_ident()}.tmp')
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+
+def fetch(url, cache_dir=DEFAULT_CACHE_DIR, offline=False, timeout=30, retries=DEFAULT_RETRIES, backoff=1.0):
+    """
+    Return a local path for url, downloading only if it changed upstream.
+
+    A cached copy is revalidated with If-None-Match / If-Modified-Since using the
+    ETag and Last-Modified from the previous response; a 304 serves it from disk.
+    With offline=True the network is never touched and a missing copy raises
+    FileNotFoundError. Connection errors and 5xx/429 responses are retried with
+    exponential backoff; if the server still can't be reached, an existing copy
+    is used.
+
+    Returns:
+        (path, status) where status is 'downloaded', 'not modified', 'offline' or 'stale'
+    """
+    data_path, meta_path = cache_paths(url, cache_dir)
+    meta = {}
+    if data_path.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+
+    if offline:
+        if not data_path.exists():
+            raise FileNotFoundError(f"{url} is not in the download cache ({data_path})")
+        return data_path, 'offline'
+
+    headers = {'Accept-Encoding': 'identity'}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    for attempt in range(retries + 1):
+        try:
+            status, response_headers, body = _get(url, headers, timeout)
+        except (http.client.HTTPException, OSError):
+            if attempt == retries:
+                if data_path.exists():
+                    return data_path, 'stale'
+                raise
+        else:
+            if status == 304 and data_path.exists():
+                return data_path, 'not modified'
+            if status == 200:
+                break
+            if status in RETRY_STATUSES and attempt == retries and data_path.exists():
+                return data_path, 'stale'
+            if status not in RETRY_STATUSES or attempt == retries:
+                raise DownloadError(url, status)
+        time.sleep(backoff * 2 ** attempt)
+
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(data_path, body)
+    _write_atomic(meta_path, json.dumps({
+        'url': url,
+        'etag': response_headers.get('ETag'),
+        'last_modified': response_headers.get('Last-Modified'),
+        'sha256': hashlib.sha256(body).hexdigest(),
+    }).encode('utf-8'))
+    return data_path, 'downloaded'
+
+def fetch_all(urls, parse=None, cache_dir=DEFAULT_CACHE_DIR, offline=False,
+              max_workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES):
+    """
+    Fetch many URLs concurrently, parsing each file in its worker as soon as it arrives.
+
+    Failures (after each file's own retries) don't stop the other downloads.
+
+    Yields (url, status, parsed, error) in completion order; parsed is parse(path),
+    or the path if no parse function is given, and error is the exception or None.
+    """
+    def job(url):
+        path, status = fetch(url, cache_dir, offline=offline, retries=retries)
+        return status, parse(path) if parse else path
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(job, url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                status, parsed = future.result()
+            except Exception as e:
+                yield url, None, None, e
+            else:
+                yield url, status, parsed, None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_csv_cached(path, cache_dir=DEFAULT_PARSED_DIR, **read_csv_kwargs):
+    """
+    pd.read_csv(path), cached as a binary columnar file.
+
+    The cached copy is keyed by the SHA-256 of the CSV and the read_csv
+    arguments, so an upstream change (or different parse options) produces a
+    new entry; older entries for the same file are removed when it's written.
+    Entry names include a hash of the CSV's resolved path, so files with the
+    same name in different directories don't evict each other.
+    """
+    path = Path(path)
+    # Callables (e.g. usecols) are keyed by name; their repr changes between runs
+    options = repr(sorted(
+        (name, f"{value.__module__}.{value.__qualname__}" if callable(value) else value)
+        for name, value in read_csv_kwargs.items()
+    ))
+    key = hashlib.sha256((file_sha256(path) + options).encode('utf-8')).hexdigest()[:16]
+    source = f"{path.stem}.{hashlib.sha256(str(path.resolve()).encode('utf-8')).hexdigest()[:8]}"
+    cache_dir = Path(cache_dir)
+    parsed_path = cache_dir / f"{source}.{key}.{PARSED_FORMAT}"
+
+    if parsed_path.exists():
+        try:
+            if PARSED_FORMAT == 'parquet':
+                return pd.read_parquet(parsed_path)
+            return pd.read_pickle(parsed_path)
+        except Exception:
+            parsed_path.unlink(missing_ok=True)  # Corrupt or from an incompatible pandas; re-parse
+
+    df = pd.read_csv(path, **read_csv_kwargs)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for old_path in cache_dir.glob(f"{source}.*.{PARSED_FORMAT}"):
+        old_path.unlink(missing_ok=True)
+    tmp_path = parsed_path.with_name(parsed_path.name + f'.{threading.get_ident()}.tmp')
+    if PARSED_FORMAT == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    tmp_path.replace(parsed_path)
+    return df
+
+def is_match_column(name):
+    return name in MATCH_DTYPES
+
+def read_match_csv(path, cache_dir):
+    """
+    Load a Sackmann match CSV with only the MATCH_DTYPES columns (via the parsed-frame cache).
+
+    The number of columns in the source file is kept in df.attrs['source_columns']
+    for memory reporting.
+    """
+    df = read_csv_cached(path, cache_dir, usecols=is_match_column, dtype=MATCH_DTYPES)
+    with open(path, encoding='utf-8') as f:
+        df.attrs['source_columns'] = len(f.readline().split(','))
+    return df
+
+def read_match_csv_chunks(path, chunksize):
+    """Iterate over a Sackmann match CSV in frames of at most chunksize rows (MATCH_DTYPES columns only)"""
+    return pd.read_csv(path, usecols=is_match_column, dtype=MATCH_DTYPES, chunksize=chunksize)
+
+def concat_match_frames(frames):
+    """
+    pd.concat of read_match_csv frames that keeps category columns categorical.
+
+    Concatenating categoricals whose categories differ (e.g. player names in
+    different years) gives plain strings, so each category column is first
+    recoded to the union of its categories across frames. The widest
+    df.attrs['source_columns'] is kept for memory reporting.
+    """
+    frames = list(frames)
+    categorical = [name for name in frames[0].columns
+                   if all(name in frame.columns and isinstance(frame[name].dtype, pd.CategoricalDtype)
+                          for frame in frames)]
+    dtypes = {name: pd.CategoricalDtype(union_categoricals([frame[name] for frame in frames]).categories)
+              for name in categorical}
+    df = pd.concat([frame.astype(dtypes) for frame in frames], ignore_index=True)
+    df.attrs['source_columns'] = max(frame.attrs.get('source_columns', len(frame.columns)) for frame in frames)
+    return df
+
+def format_memory_saving(frames):
+    """
+    Memory used by frames from read_match_csv, against a lower bound for loading all
+    source columns with default dtypes (8 bytes per cell, ignoring string payloads).
+    """
+    used = sum(df.memory_usage(deep=True).sum() for df in frames)
+    baseline = sum(len(df) * df.attrs.get('source_columns', len(df.columns)) * 8 for df in frames)
+    saved = (1 - used / baseline) * 100 if baseline else 0.0
+    return (f"Memory: {used / 1024 / 1024:.1f} MB for {len(MATCH_DTYPES)} columns "
+            f"(at least {baseline / 1024 / 1024:.1f} MB with all columns and default dtypes, {saved:.0f}% saved)")
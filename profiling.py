@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Pipeline Profiling
+Per-stage timing for update_data.py, plus optional cProfile and sampled
+collapsed stacks (for flamegraph.pl / speedscope)
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows; peak RSS is reported as None
+
+def peak_rss_mb(who='self'):
+    """High-water mark of resident memory for this process (or its finished children), in MB"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+class Stage:
+    """One timed stage; set rows_out (and rows_in, if not known up front) inside the with block"""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss_mb = None
+        self.notes = None
+
+    def to_dict(self):
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        return {
+            'stage': self.name,
+            'wall_s': round(self.wall, 6),
+            'cpu_s': round(self.cpu, 6),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rows_per_s': round(rows / self.wall, 1) if rows is not None and self.wall > 0 else None,
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'notes': self.notes,
+        }
+
+class StageTimer:
+    """
+    Records wall and CPU time, rows in/out and peak RSS for each pipeline stage.
+
+        timer = StageTimer()
+        with timer.stage('filter', rows_in=len(results)) as stage:
+            results = [r for r in results if completed(r)]
+            stage.rows_out = len(results)
+
+    CPU time is the process's (all threads, not child processes). Peak RSS is
+    the process high-water mark when the stage ends, so it only grows; a stage
+    that raised it is the one where it first jumps.
+
+    Timing a stage name again adds to its totals (leave rows unset on the
+    later pieces if they'd double count). Stages measured elsewhere, e.g. in
+    worker processes, are folded in with record() or add().
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.started = time.time()
+
+    def _merge(self, name, wall, cpu, rows_in=None, rows_out=None, rss=None, notes=None):
+        stage = next((stage for stage in self.stages if stage.name == name), None)
+        if stage is None:
+            stage = Stage(name)
+            self.stages.append(stage)
+        stage.wall += wall
+        stage.cpu += cpu
+        if rows_in is not None:
+            stage.rows_in = (stage.rows_in or 0) + rows_in
+        if rows_out is not None:
+            stage.rows_out = (stage.rows_out or 0) + rows_out
+        if rss is not None:
+            stage.peak_rss_mb = max(stage.peak_rss_mb or 0, rss)
+        if notes is not None:
+            stage.notes = notes
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        stage = Stage(name, rows_in)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stage
+        finally:
+            self._merge(name, time.perf_counter() - wall_start, time.process_time() - cpu_start,
+                        stage.rows_in, stage.rows_out, peak_rss_mb(), stage.notes)
+
+    def record(self, name, wall, cpu, rows_in=None, rows_out=None, notes=None):
+        """Add a stage measured by the caller (e.g. summed over threads)"""
+        self._merge(name, wall, cpu, rows_in, rows_out, peak_rss_mb(), notes)
+
+    def add(self, stage_dicts, notes=None):
+        """Fold in stages from another timer's report()['stages'] (e.g. a worker process's)"""
+        for entry in stage_dicts:
+            self._merge(entry['stage'], entry['wall_s'], entry['cpu_s'], entry['rows_in'], entry['rows_out'],
+                        entry['peak_rss_mb'], notes)
+
+    def report(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+            'total_wall_s': round(time.time() - self.started, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_children_mb': peak_rss_mb('children'),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def print_summary(self):
+        print(f"\n{'Stage':<12} {'Wall':>9} {'CPU':>9} {'Rows in':>10} {'Rows out':>10} {'Rows/s':>12} {'Peak RSS':>10}")
+        for entry in self.report()['stages']:
+            def count(value):
+                return f"{value:,}" if value is not None else '-'
+            rate = f"{entry['rows_per_s']:,.0f}" if entry['rows_per_s'] is not None else '-'
+            rss = f"{entry['peak_rss_mb']:.0f}MB" if entry['peak_rss_mb'] is not None else '-'
+            note = f"  ({entry['notes']})" if entry['notes'] else ''
+            print(f"{entry['stage']:<12} {entry['wall_s']:8.2f}s {entry['cpu_s']:8.2f}s {count(entry['rows_in']):>10} "
+                  f"{count(entry['rows_out']):>10} {rate:>12} {rss:>10}{note}")
+
+    def write_json(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(), indent=2))
+
+class StackSampler:
+    """
+    Samples the Python stacks of every thread in this process from a background
+    thread and writes them in collapsed form ("root;caller;callee count" per
+    line), the input format of flamegraph.pl and speedscope.
+
+    Threads other than the main one are rooted at their thread name. Worker
+    processes (--jobs) aren't sampled.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if thread_id != threading.main_thread().ident:
+                    stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,970 @@
+#!/usr/bin/env python3
+"""
+Serve Simulation Engines
+Shared serve model and simulation code used by tennis_serve_analyzer.py and update_data.py
+"""
+
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# Available engines for simulate_match_outcome
+#   loop       - original point-by-point Python loop
+#   vectorized - all simulations for a performance drawn at once as binomial counts
+#   exact      - closed-form binomial tail, no sampling
+#   markov     - point -> game -> tiebreak -> set -> match probabilities against the
+#                opponent's serve, no sampling (see markov_match_probability)
+#   match      - Monte Carlo over the real scoring: games, tiebreaks and sets for both
+#                servers, all simulations resolved together as arrays (see play_matches)
+ENGINES = ('loop', 'vectorized', 'exact', 'markov', 'match')
+
+# Engines that simulate_batch can run over many performances at once
+BATCH_ENGINES = ('vectorized', 'exact', 'markov', 'match')
+
+# Batch engines whose results carry sampling noise
+SAMPLING_ENGINES = ('vectorized', 'match')
+
+# Engines that play the opponent's service games too, so need their serve stats
+OPPONENT_ENGINES = ('markov', 'match')
+
+# How the two strategies' simulations are drawn ('match' engine only; the vectorized
+# engine's answer is a binomial tail, which 'exact' computes without noise)
+#   independent - separate random numbers for each strategy
+#   crn         - common random numbers: both strategies use the same draws
+#   antithetic  - common random numbers, half of them mirrored (u and 1 - u pairs)
+VARIANCE_REDUCTION = ('independent', 'crn', 'antithetic')
+
+# A simulated win-probability change larger than this could have flipped the result
+FLIP_THRESHOLD = 0.15
+
+# simulate_adaptive stops a row once the interval of this many standard errors around its
+# simulated difference is clear of +-FLIP_THRESHOLD (1.96: 95% two-sided)
+CONFIDENCE_Z = 1.96
+
+# Final scores in sets, from the player's side, for each match format
+SET_SCORES = {3: ('2-0', '2-1', '1-2', '0-2'),
+              5: ('3-0', '3-1', '3-2', '2-3', '1-3', '0-3')}
+
+# Column order of the set-score arrays returned with return_set_scores (both formats)
+SET_SCORE_LABELS = SET_SCORES[3] + SET_SCORES[5]
+
+# Tournament names (lowercased) played best-of-5 on the ATP tour
+GRAND_SLAMS = ('australian open', 'roland garros', 'wimbledon', 'us open')
+
+# Bump whenever an engine's output for the same inputs changes; invalidates SimulationCache files
+ENGINE_VERSION = 2
+
+# Root entropy for per-performance random streams (see performance_rng)
+BASE_SEED = 42
+
+# Upper bound on the simulation arrays held in memory at once by simulate_batch
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes
+
+# The markov engine looks set probabilities up in a table over this many steps of
+# each serve-point probability (interpolated between grid points); changing it changes
+# markov results, so bump ENGINE_VERSION too
+MARKOV_GRID_STEPS = 500
+
+def win_threshold(best_of):
+    """Share of service points needed to count as a match win (placeholder heuristic)"""
+    return 0.58 if best_of == 3 else 0.56
+
+def performance_rng(key, base_seed=BASE_SEED):
+    """
+    Independent random generator for one performance.
+
+    The stream is spawned from BASE_SEED with a spawn key derived from key (a
+    performance's serve-count tuple, see simulate_counts), so it doesn't depend
+    on row order, worker count, or which other matches are in the dataset.
+    """
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    spawn_key = tuple(int.from_bytes(digest[i:i + 4], 'little') for i in range(0, 16, 4))
+    return np.random.default_rng(np.random.SeedSequence(base_seed, spawn_key=spawn_key))
+
+def point_win_probs(first_in_pct, first_win_pct, second_win_pct):
+    """
+    Per-point win probability under each serving strategy.
+
+    Returns:
+        traditional: first serve, then second serve if it misses
+        only_first: first serve both times, double fault if both miss
+    """
+    traditional = first_in_pct * first_win_pct + (1 - first_in_pct) * second_win_pct
+    only_first = first_in_pct * first_win_pct + (1 - first_in_pct) * first_in_pct * first_win_pct
+    return traditional, only_first
+
+def simulate_vectorized(first_in_pct, first_win_pct, second_win_pct, service_points,
+                        best_of=3, num_sims=1000, rng=None):
+    """
+    Vectorized equivalent of the point-by-point simulation.
+
+    Each service point is an independent Bernoulli trial, so the points won in one
+    simulated match are Binomial(service_points, p). Drawing all num_sims counts in
+    one call gives the same distribution as the loop at a fraction of the cost.
+
+    Returns:
+        (traditional_wins, only_first_wins) out of num_sims
+    """
+    if service_points <= 0:
+        return 0, 0
+
+    rng = np.random if rng is None else rng
+    trad_p, only_first_p = point_win_probs(first_in_pct, first_win_pct, second_win_pct)
+    threshold = win_threshold(best_of)
+
+    trad_points_won = rng.binomial(service_points, trad_p, size=num_sims)
+    only_first_points_won = rng.binomial(service_points, only_first_p, size=num_sims)
+
+    traditional_wins = int(np.count_nonzero(trad_points_won / service_points > threshold))
+    only_first_wins = int(np.count_nonzero(only_first_points_won / service_points > threshold))
+    return traditional_wins, only_first_wins
+
+def min_points_to_win(service_points, threshold):
+    """Smallest k with k / service_points > threshold (same float comparison as the simulation)"""
+    n = np.where(service_points > 0, service_points, 1)
+    k = np.floor(threshold * n).astype(np.int64) + 1
+    # floor() can be off by one when threshold * n lands on a rounding boundary
+    k = np.where((k - 1) / n > threshold, k - 1, k)
+    k = np.where(k / n <= threshold, k + 1, k)
+    return k
+
+def binomial_tail(n, p, k_min):
+    """
+    P(X >= k_min) for X ~ Binomial(n, p), vectorized over rows.
+
+    The pmf is evaluated in log space from a log-factorial table so long
+    best-of-5 matches with extreme serve percentages don't underflow.
+    """
+    n = np.asarray(n, dtype=np.int64)
+    p = np.clip(np.asarray(p, dtype=float), 0.0, 1.0)
+    max_n = int(n.max()) if n.size else 0
+    log_factorial = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, max_n + 1)))))
+
+    k = np.arange(max_n + 1)[None, :]
+    n_col = n[:, None]
+    p_col = p[:, None]
+    valid = (k <= n_col) & (k >= k_min[:, None])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_p = np.where(k > 0, k * np.log(p_col), 0.0)
+        log_q = np.where(n_col - k > 0, (n_col - k) * np.log1p(-p_col), 0.0)
+        log_choose = log_factorial[n][:, None] - log_factorial[k] - log_factorial[np.clip(n_col - k, 0, None)]
+        log_pmf = log_choose + log_p + log_q
+
+    pmf = np.where(valid, np.exp(np.where(valid, log_pmf, -np.inf)), 0.0)
+    return np.clip(pmf.sum(axis=1), 0.0, 1.0)
+
+def hold_probability(p):
+    """
+    Probability the server wins a game, winning each point with probability p.
+
+    Closed form: win to 0, 15 or 30, or reach deuce and win two points in a row
+    before losing two, p^2 / (p^2 + q^2).
+    """
+    p = np.asarray(p, dtype=float)
+    q = 1 - p
+    deuce = p**2 / (p**2 + q**2)  # p^2 + q^2 >= 0.5, never zero
+    return p**4 * (1 + 4*q + 10*q**2) + 20 * p**3 * q**3 * deuce
+
+def _win_from_tie(win_both, lose_both):
+    """Winning a 'two clear' race from level: P(win both of a pair) / P(pair decides it)"""
+    decided = win_both + lose_both
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(decided > 0, win_both / np.where(decided > 0, decided, 1), 0.5)
+
+def tiebreak_probability(p, q):
+    """
+    Probability of winning a first-to-7 (by two) tiebreak, serving the first point.
+
+    p is the player's serve-point win probability, q the opponent's. Serve
+    alternates after the first point and then every two points, so from 6-6
+    each pair of points is one serve each.
+    """
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    reach = {(0, 0): np.ones(np.broadcast(p, q).shape)}
+    win = np.zeros_like(reach[0, 0])
+    for played in range(12):
+        for i in range(max(0, played - 6), min(played, 6) + 1):
+            j = played - i
+            if (i, j) not in reach:
+                continue
+            # Point n (from 1) is the player's serve when n // 2 is even
+            point = p if ((played + 1) // 2) % 2 == 0 else 1 - q
+            here = reach.pop((i, j))
+            if i == 6:
+                win += here * point
+            else:
+                reach[i + 1, j] = reach.get((i + 1, j), 0) + here * point
+            if j < 6:
+                reach[i, j + 1] = reach.get((i, j + 1), 0) + here * (1 - point)
+    return win + reach[6, 6] * _win_from_tie(p * (1 - q), (1 - p) * q)
+
+def set_probability(p, q):
+    """
+    Probability of winning a set (tiebreak at 6-6), serving the first game.
+
+    By Newton and Keller (2005) this doesn't depend on who serves first when
+    points are independent, so it's also the chance of winning any later set.
+    """
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    hold = hold_probability(p)
+    broken = 1 - hold_probability(q)  # Player wins a game on the opponent's serve
+    reach = {(0, 0): np.ones(np.broadcast(p, q).shape)}
+    win = np.zeros_like(reach[0, 0])
+    for played in range(12):
+        for i in range(max(0, played - 6), min(played, 6) + 1):
+            j = played - i
+            if (i, j) not in reach:
+                continue
+            game = hold if played % 2 == 0 else broken
+            here = reach.pop((i, j))
+            # 6-x (x <= 4) and 7-5 end the set; 6-5 and 5-6 play on
+            if i == 6 or (i == 5 and j <= 4):
+                win += here * game
+            else:
+                reach[i + 1, j] = reach.get((i + 1, j), 0) + here * game
+            if not (j == 6 or (j == 5 and i <= 4)):
+                reach[i, j + 1] = reach.get((i, j + 1), 0) + here * (1 - game)
+    # Game 13, the tiebreak, is served first by whoever served the first game
+    return win + reach[6, 6] * tiebreak_probability(p, q)
+
+def match_probability_from_sets(set_prob, best_of):
+    """Probability of winning a best-of-3 or best-of-5 match when every set is won with set_prob"""
+    s = np.asarray(set_prob, dtype=float)
+    lose = 1 - s
+    return np.where(np.asarray(best_of) == 5,
+                    s**3 * (1 + 3*lose + 6*lose**2),
+                    s**2 * (1 + 2*lose))
+
+@lru_cache(maxsize=4)
+def markov_set_table(steps=MARKOV_GRID_STEPS):
+    """set_probability on a (steps + 1) x (steps + 1) grid of (p, q), built once per process"""
+    grid = np.linspace(0.0, 1.0, steps + 1)
+    table = set_probability(grid[:, None], grid[None, :])
+    table.flags.writeable = False
+    return table
+
+def markov_match_probability(p, q, best_of, steps=MARKOV_GRID_STEPS):
+    """
+    Match win probability from serve-point probabilities p (player) and q (opponent).
+
+    Set probabilities come from markov_set_table by bilinear interpolation, so
+    each lookup is O(1) however many performances are evaluated; the table is
+    computed with the full game/tiebreak/set recursion on first use.
+    """
+    table = markov_set_table(steps)
+    x = np.clip(np.asarray(p, dtype=float), 0.0, 1.0) * steps
+    y = np.clip(np.asarray(q, dtype=float), 0.0, 1.0) * steps
+    x0 = np.minimum(np.floor(x).astype(np.int64), steps - 1)
+    y0 = np.minimum(np.floor(y).astype(np.int64), steps - 1)
+    dx, dy = x - x0, y - y0
+    set_prob = (table[x0, y0] * (1 - dx) * (1 - dy) + table[x0 + 1, y0] * dx * (1 - dy)
+                + table[x0, y0 + 1] * (1 - dx) * dy + table[x0 + 1, y0 + 1] * dx * dy)
+    return match_probability_from_sets(set_prob, best_of)
+
+def play_matches(p, q, best_of, uniforms):
+    """
+    Play out matches game by game for every row and simulation at once.
+
+    p and q are per-row serve-point probabilities (player, opponent); uniforms
+    is a (rows, sets, 13, sims) array of U(0, 1) draws, one per game slot of
+    each set, with sets >= 3 or 5 as the format needs (see match_uniforms).
+    Each game is won with its exact probability given the point probabilities
+    (hold_probability, or tiebreak_probability for the 13th), and serve
+    alternates every game.
+
+    Sets are resolved without a loop over games: whoever has 6 of the first
+    10 games won the set 6-x (x <= 4); from 5-5, games 11 and 12 make it 7-5
+    or 6-6 and the tiebreak. Every set starts with the player serving, which
+    leaves set (and so match) outcomes unchanged, since who serves first
+    doesn't affect the chance of winning a set (Newton and Keller, 2005).
+
+    Returns:
+        (won, sets_won, sets_lost) as (rows, sims) arrays
+    """
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    best_of = np.broadcast_to(np.asarray(best_of), p.shape)
+    sets_needed = np.where(best_of == 5, 3, 2)[:, None]
+    rows, max_sets, _, sims = uniforms.shape
+
+    # Game-win probability per slot: player serves the even slots and the first tiebreak point
+    hold = hold_probability(p)[:, None]
+    broken = 1 - hold_probability(q)[:, None]
+    game_probs = np.hstack([np.where(np.arange(12) % 2 == 0, hold, broken), tiebreak_probability(p, q)[:, None]])
+    game_won = uniforms < game_probs.astype(np.float32)[:, None, :, None]
+
+    games = game_won.view(np.int8)
+    first_ten = games[:, :, 0] + games[:, :, 1]
+    for slot in range(2, 10):
+        first_ten += games[:, :, slot]
+    next_two = games[:, :, 10] + games[:, :, 11]
+    set_won = (first_ten >= 6) | ((first_ten == 5) & ((next_two == 2) | ((next_two == 1) & game_won[:, :, 12])))
+
+    # Sets are counted until one side has enough; later sets (and slots past the format) are never reached
+    sets_won = np.zeros((rows, sims), dtype=np.int8)
+    sets_lost = np.zeros((rows, sims), dtype=np.int8)
+    for set_index in range(max_sets):
+        playing = (sets_won < sets_needed) & (sets_lost < sets_needed)
+        sets_won += playing & set_won[:, set_index]
+        sets_lost += playing & ~set_won[:, set_index]
+    return sets_won == sets_needed, sets_won, sets_lost
+
+def match_uniforms(num_rows, num_sims, max_sets, draws=1, rng=None, keys=None, sets=None):
+    """
+    U(0, 1) draws for play_matches, shape (rows, draws, max_sets, 13, sims), float32.
+
+    With keys each row's block comes from its own performance_rng stream, so
+    results don't depend on chunking; sets (per row) limits the draws to the
+    sets the row's format can use, leaving the rest zero. Otherwise rng (the
+    global numpy generator by default) fills the whole array.
+    """
+    shape = (num_rows, draws, max_sets, 13, num_sims)
+    if keys is None:
+        if not isinstance(rng, np.random.Generator):
+            # Legacy generators can't draw float32; seed a Generator from them so np.random.seed still applies
+            rng = np.random.default_rng((np.random if rng is None else rng).randint(2**32, size=4))
+        return rng.random(shape, dtype=np.float32)
+    uniforms = np.zeros(shape, dtype=np.float32)
+    for row, key in enumerate(keys):
+        row_sets = max_sets if sets is None else int(sets[row])
+        uniforms[row, :, :row_sets] = performance_rng(key).random((draws, row_sets, 13, num_sims), dtype=np.float32)
+    return uniforms
+
+def strategy_uniforms(num_rows, num_sims, max_sets, variance_reduction='independent', rng=None, keys=None,
+                      sets=None):
+    """
+    match_uniforms for both strategies under a VARIANCE_REDUCTION mode.
+
+    'independent' draws a block per strategy, 'crn' one block shared by both,
+    and 'antithetic' num_sims / 2 shared draws followed by their mirror images
+    1 - u, so sim j and sim j + num_sims / 2 are a pair (see difference_se).
+
+    Returns:
+        (traditional, only_first) arrays of shape (rows, max_sets, 13, sims)
+    """
+    if variance_reduction == 'independent':
+        uniforms = match_uniforms(num_rows, num_sims, max_sets, draws=2, rng=rng, keys=keys, sets=sets)
+        return uniforms[:, 0], uniforms[:, 1]
+    antithetic = variance_reduction == 'antithetic'
+    uniforms = match_uniforms(num_rows, num_sims // 2 if antithetic else num_sims, max_sets, rng=rng, keys=keys,
+                              sets=sets)[:, 0]
+    if antithetic:
+        uniforms = np.concatenate([uniforms, 1 - uniforms], axis=-1)
+    return uniforms, uniforms
+
+def set_score_distribution(sets_won, sets_lost):
+    """Share of simulations ending in each SET_SCORES score, from play_matches' (rows, sims) set counts"""
+    scores = {}
+    for labels in SET_SCORES.values():
+        for label in labels:
+            won, lost = map(int, label.split('-'))
+            scores[label] = ((sets_won == won) & (sets_lost == lost)).mean(axis=1)
+    return pd.DataFrame(scores)
+
+def simulate_set_scores(first_in_pct, first_win_pct, second_win_pct, service_points, best_of, num_sims=1000,
+                        memory_budget=DEFAULT_MEMORY_BUDGET, rng=None, keys=None, opponent_p=None,
+                        variance_reduction='independent'):
+    """
+    Distribution of the final score in sets for every performance, under each strategy.
+
+    simulate_batch with engine='match' and return_set_scores, as DataFrames.
+
+    Returns:
+        (traditional, only_first) DataFrames with one column per SET_SCORE_LABELS
+        label (the other format's labels are 0), all 0 for rows without
+        service points
+    """
+    set_scores = simulate_batch(first_in_pct, first_win_pct, second_win_pct, service_points, best_of,
+                                num_sims=num_sims, engine='match', memory_budget=memory_budget, rng=rng, keys=keys,
+                                opponent_p=opponent_p, variance_reduction=variance_reduction,
+                                return_set_scores=True)[2]
+    return tuple(pd.DataFrame(set_scores[:, strategy], columns=list(SET_SCORE_LABELS)) for strategy in (0, 1))
+
+def column_or(df, name, default):
+    """df[name] if the column exists, otherwise a constant (or aligned array) default"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index)
+
+def performance_frame(df_clean, **match_columns):
+    """
+    Reshape w_* / l_* serve columns into one row per player per match.
+
+    match_columns are per-match values (Series aligned with df_clean) copied onto
+    both performances of each match. Rows keep the original order: winner then
+    loser for each match, skipping performances with zero service points, zero
+    first serves in, or no second serve points.
+
+    Returns a DataFrame with match_index, side ('w'/'l'), won, player, opponent,
+    the raw counts (svpt, first_in, first_won, second_won), the opponent's
+    service points played and won (opp_svpt, opp_points_won), the match_columns,
+    and the derived first_in_pct, first_win_pct, second_win_pct, only_first,
+    traditional and only_first_better columns.
+    """
+    winner = column_or(df_clean, 'winner_name', 'Unknown')
+    loser = column_or(df_clean, 'loser_name', 'Unknown')
+    parts = []
+    for side, other, won, player, opponent in (('w', 'l', True, winner, loser), ('l', 'w', False, loser, winner)):
+        part = pd.DataFrame({
+            'row': np.arange(len(df_clean)),
+            'match_index': df_clean.index,
+            'side': side,
+            'won': won,
+            'player': player.to_numpy(),
+            'opponent': opponent.to_numpy(),
+            'svpt': df_clean[f'{side}_svpt'].to_numpy(),
+            'first_in': df_clean[f'{side}_1stIn'].to_numpy(),
+            'first_won': df_clean[f'{side}_1stWon'].to_numpy(),
+            'second_won': df_clean[f'{side}_2ndWon'].to_numpy(),
+            'opp_svpt': df_clean[f'{other}_svpt'].to_numpy(),
+            'opp_points_won': (df_clean[f'{other}_1stWon'] + df_clean[f'{other}_2ndWon']).to_numpy(),
+        })
+        for name, values in match_columns.items():
+            part[name] = pd.Series(values, index=df_clean.index).to_numpy()
+        parts.append(part)
+
+    # Interleave so each match yields its winner row, then its loser row
+    perf = pd.concat(parts, ignore_index=True)
+    perf = perf.sort_values('row', kind='stable').reset_index(drop=True)
+
+    svpt = perf['svpt'].to_numpy(dtype=float)
+    first_in = perf['first_in'].to_numpy(dtype=float)
+    second_serve_points = svpt - first_in
+    valid = (svpt > 0) & (first_in > 0) & (second_serve_points > 0)
+    perf = perf[valid].reset_index(drop=True)
+    svpt, first_in, second_serve_points = svpt[valid], first_in[valid], second_serve_points[valid]
+
+    perf['first_in_pct'] = first_in / svpt
+    perf['first_win_pct'] = perf['first_won'].to_numpy(dtype=float) / first_in
+    perf['second_win_pct'] = perf['second_won'].to_numpy(dtype=float) / second_serve_points
+    perf['traditional'], perf['only_first'] = point_win_probs(
+        perf['first_in_pct'], perf['first_win_pct'], perf['second_win_pct'])
+    perf['only_first_better'] = (perf['first_in_pct'] * perf['first_win_pct']) > perf['second_win_pct']
+    return perf.drop(columns='row')
+
+def resolve_best_of(df, bo5_tours=('ATP',)):
+    """
+    Match format (3 or 5) for every row of a Sackmann match frame.
+
+    Resolution order:
+      1. the native best_of column, when it holds 3 or 5
+      2. tourney_level 'G' (Grand Slam), best-of-5 for tours in bo5_tours
+      3. a per-tournament name lookup against GRAND_SLAMS, computed once per
+         unique tourney_name rather than once per row
+
+    Rows without a tour column are treated as ATP.
+
+    Returns:
+        best_of: int array aligned with df
+        unresolved: sorted tournament names that had no native format info and
+            didn't match a known slam, so were assumed best-of-3
+    """
+    tour = column_or(df, 'tour', 'ATP')
+    bo5_tour = tour.isin(bo5_tours).to_numpy()
+
+    native = pd.to_numeric(column_or(df, 'best_of', np.nan), errors='coerce').to_numpy()
+    has_native = np.isin(native, (3, 5))
+
+    level = column_or(df, 'tourney_level', None)
+    has_level = level.notna().to_numpy() & ~has_native
+    level_slam = (level == 'G').to_numpy()
+
+    # String work once per unique tournament name
+    codes, names = pd.factorize(column_or(df, 'tourney_name', '').astype(object).fillna(''))
+    name_is_slam = np.array([any(slam in name.lower() for slam in GRAND_SLAMS) for name in names], dtype=bool)
+    row_name_slam = name_is_slam[codes]
+
+    by_name = ~has_native & ~has_level
+    is_slam = np.where(has_level, level_slam, row_name_slam)
+    best_of = np.where(has_native, np.nan_to_num(native, nan=3).astype(int),
+                       np.where(is_slam & bo5_tour, 5, 3))
+
+    unresolved_codes = np.unique(codes[by_name & ~row_name_slam])
+    unresolved = sorted(str(names[code]) for code in unresolved_codes if names[code])
+    return best_of, unresolved
+
+def performance_keys(perf):
+    """Stable identity of every row of a performance_frame with tour/tourney_id/match_num: 'ATP|2024-580|101|w'"""
+    return (perf['tour'].astype(str) + '|' + perf['tourney_id'].astype(str) + '|'
+            + perf['match_num'].astype(str) + '|' + perf['side'])
+
+def chunk_bounds(num_rows, row_bytes, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Yield (start, stop) slices so that each chunk needs at most memory_budget bytes"""
+    rows_per_chunk = max(1, int(memory_budget // max(row_bytes, 1)))
+    for start in range(0, num_rows, rows_per_chunk):
+        yield start, min(start + rows_per_chunk, num_rows)
+
+def difference_se(trad_won, only_first_won, antithetic=False):
+    """
+    Standard error of the simulated only_first - traditional win probability, per row.
+
+    trad_won / only_first_won are (rows x sims) per-simulation outcomes. Sims
+    with the same index form one sample of the difference (so correlation from
+    common random numbers is accounted for); with antithetic=True, sim j and
+    sim j + sims/2 are a mirrored pair and their mean is one sample.
+    """
+    diff = only_first_won.astype(np.float32) - trad_won
+    if antithetic:
+        half = diff.shape[1] // 2
+        diff = (diff[:, :half] + diff[:, half:]) / 2
+    if diff.shape[1] < 2:
+        return np.zeros(len(diff))
+    return diff.std(axis=1, ddof=1) / np.sqrt(diff.shape[1])
+
+def check_variance_reduction(engine, variance_reduction, num_sims):
+    """Raise ValueError unless variance_reduction (see VARIANCE_REDUCTION) can be used with engine and num_sims"""
+    if variance_reduction not in VARIANCE_REDUCTION:
+        raise ValueError(f"Unknown variance reduction {variance_reduction!r}, expected one of {VARIANCE_REDUCTION}")
+    if variance_reduction != 'independent' and engine in ('loop', 'vectorized'):
+        raise ValueError(f"Variance reduction {variance_reduction!r} applies to the 'match' engine only; "
+                         f"use engine='exact' for a noise-free vectorized difference")
+    if variance_reduction == 'antithetic' and num_sims % 2:
+        raise ValueError(f"Antithetic pairs need an even number of simulations, got {num_sims}")
+
+def simulate_batch(first_in_pct, first_win_pct, second_win_pct, service_points, best_of,
+                   num_sims=1000, engine='vectorized', memory_budget=DEFAULT_MEMORY_BUDGET, rng=None, keys=None,
+                   opponent_p=None, variance_reduction='independent', return_se=False, return_set_scores=False):
+    """
+    Simulate every performance in one call.
+
+    All inputs are equal-length arrays (one entry per player performance). Rows are
+    processed in chunks sized so the (rows x num_sims) draw matrices stay within
+    memory_budget, so a full-history run uses a fixed amount of RAM.
+
+    engine='exact' computes P(points won / svpt > threshold) directly from the
+    binomial CDF, so results carry no sampling noise and need no seeding.
+
+    engine='markov' plays out the match structure analytically: the player
+    serves with each strategy's point probability and the opponent with
+    opponent_p (their serve-point win probability in the same match; NaN or
+    None means evenly matched, i.e. the player's traditional probability).
+    engine='match' samples the same structure with play_matches.
+
+    variance_reduction (one of VARIANCE_REDUCTION) applies to engine='match'.
+    With 'crn' both strategies are simulated from the same uniform draws:
+    every game slot shares its draw, so games on the opponent's serve play out
+    identically. The two probabilities then move together and their difference
+    has far less noise. 'antithetic' additionally pairs every draw u with
+    1 - u, and needs an even num_sims. The vectorized engine only supports
+    'independent': its result is a binomial tail, so shared draws would just
+    add noise to what engine='exact' computes directly.
+
+    If keys (one string per row, e.g. simulate_counts' serve-count tuples) are
+    given, each row draws from its own performance_rng stream and results are
+    reproducible row by row; otherwise all rows share rng (the global numpy
+    generator by default).
+
+    return_set_scores (engine='match' only) adds the share of simulations
+    ending in each SET_SCORE_LABELS score, taken from the same simulated
+    matches as the win probabilities, so each strategy's winning shares add
+    up to its win probability.
+
+    Returns:
+        (traditional_prob, only_first_prob) as float arrays, plus the standard
+        error of only_first_prob - traditional_prob (see difference_se; 0 for
+        the engines without sampling) if return_se is set, plus a
+        (rows, 2, len(SET_SCORE_LABELS)) array of set-score shares (traditional
+        first, all 0 for rows without service points) if return_set_scores is set
+    """
+    if engine not in BATCH_ENGINES:
+        raise ValueError(f"Engine {engine!r} cannot run in batch mode, expected one of {BATCH_ENGINES}")
+    if return_set_scores and engine != 'match':
+        raise ValueError(f"Set scores are only simulated by the 'match' engine, not {engine!r}")
+    check_variance_reduction(engine, variance_reduction, num_sims)
+
+    result = _simulate_batch(first_in_pct, first_win_pct, second_win_pct, service_points, best_of, num_sims,
+                             engine, memory_budget, rng, keys, opponent_p, variance_reduction)
+    return result[:2] + (result[2:3] if return_se else ()) + (result[3:] if return_set_scores else ())
+
+def _simulate_batch(first_in_pct, first_win_pct, second_win_pct, service_points, best_of, num_sims,
+                    engine, memory_budget, rng, keys, opponent_p, variance_reduction):
+    """simulate_batch, always returning (traditional_prob, only_first_prob, diff_se, set_scores or None)"""
+    rng = np.random if rng is None else rng
+    first_in_pct = np.asarray(first_in_pct, dtype=float)
+    first_win_pct = np.asarray(first_win_pct, dtype=float)
+    second_win_pct = np.asarray(second_win_pct, dtype=float)
+    service_points = np.asarray(service_points, dtype=np.int64)
+    best_of = np.broadcast_to(np.asarray(best_of), service_points.shape)
+
+    trad_p, only_first_p = point_win_probs(first_in_pct, first_win_pct, second_win_pct)
+    threshold = np.where(best_of == 3, 0.58, 0.56)
+
+    num_rows = len(service_points)
+    traditional_prob = np.zeros(num_rows)
+    only_first_prob = np.zeros(num_rows)
+    diff_se = np.zeros(num_rows)
+    antithetic = variance_reduction == 'antithetic'
+
+    if engine in OPPONENT_ENGINES:
+        played = service_points > 0
+        opponent_p = trad_p if opponent_p is None else np.asarray(opponent_p, dtype=float)
+        opponent_p = np.where(np.isnan(opponent_p), trad_p, opponent_p)
+        # Rows without serve points come out as 0 like the other engines; keep NaN out of the lookups
+        trad_p, only_first_p, opponent_p = (np.where(played, prob, 0.5) for prob in (trad_p, only_first_p, opponent_p))
+
+    if engine == 'markov':
+        traditional_prob = np.where(played, markov_match_probability(trad_p, opponent_p, best_of), 0.0)
+        only_first_prob = np.where(played, markov_match_probability(only_first_p, opponent_p, best_of), 0.0)
+        return traditional_prob, only_first_prob, diff_se, None
+
+    if engine == 'match':
+        set_scores = np.zeros((num_rows, 2, len(SET_SCORE_LABELS)))
+        max_sets = int(best_of.max(initial=3))
+        # float32 draws for both strategies, plus a bool per draw and small per-set arrays
+        row_bytes = num_sims * max_sets * 13 * (4 * 2 + 2)
+        for start, stop in chunk_bounds(num_rows, row_bytes, memory_budget):
+            rows = slice(start, stop)
+            chunk_keys = None if keys is None else keys[start:stop]
+            chunk_sets = int(best_of[rows].max())
+            trad_draws, only_first_draws = strategy_uniforms(stop - start, num_sims, chunk_sets, variance_reduction,
+                                                             rng=rng, keys=chunk_keys, sets=best_of[rows])
+            trad_won, *trad_sets = play_matches(trad_p[rows], opponent_p[rows], best_of[rows], trad_draws)
+            only_first_won, *only_first_sets = play_matches(only_first_p[rows], opponent_p[rows], best_of[rows],
+                                                            only_first_draws)
+            for strategy, sets in enumerate((trad_sets, only_first_sets)):
+                shares = set_score_distribution(*sets)[list(SET_SCORE_LABELS)].to_numpy()
+                set_scores[rows, strategy] = shares * played[rows, None]
+            traditional_prob[rows] = np.where(played[rows], trad_won.mean(axis=1), 0.0)
+            only_first_prob[rows] = np.where(played[rows], only_first_won.mean(axis=1), 0.0)
+            diff_se[rows] = np.where(played[rows], difference_se(trad_won, only_first_won, antithetic), 0.0)
+        return traditional_prob, only_first_prob, diff_se, set_scores
+
+    if engine == 'exact':
+        k_min = min_points_to_win(service_points, threshold)
+        played = service_points > 0
+        # A handful of float64 (rows x max_svpt) work matrices per chunk
+        row_bytes = (int(service_points.max(initial=0)) + 1) * 8 * 8
+        for start, stop in chunk_bounds(num_rows, row_bytes, memory_budget):
+            rows = slice(start, stop)
+            traditional_prob[rows] = np.where(
+                played[rows], binomial_tail(service_points[rows], trad_p[rows], k_min[rows]), 0.0)
+            only_first_prob[rows] = np.where(
+                played[rows], binomial_tail(service_points[rows], only_first_p[rows], k_min[rows]), 0.0)
+        return traditional_prob, only_first_prob, diff_se, None
+
+    # Two int64 count matrices plus their float ratios per row
+    row_bytes = num_sims * 8 * 4
+    for start, stop in chunk_bounds(num_rows, row_bytes, memory_budget):
+        n = service_points[start:stop, None]
+        played = n[:, 0] > 0
+        denom = np.where(n > 0, n, 1)
+        limit = threshold[start:stop, None]
+
+        if keys is None:
+            trad_points_won = rng.binomial(n, trad_p[start:stop, None], size=(stop - start, num_sims))
+            only_first_points_won = rng.binomial(n, only_first_p[start:stop, None], size=(stop - start, num_sims))
+        else:
+            trad_points_won = np.empty((stop - start, num_sims), dtype=np.int64)
+            only_first_points_won = np.empty((stop - start, num_sims), dtype=np.int64)
+            for row in range(start, stop):
+                row_rng = performance_rng(keys[row])
+                trad_points_won[row - start] = row_rng.binomial(service_points[row], trad_p[row], size=num_sims)
+                only_first_points_won[row - start] = row_rng.binomial(service_points[row], only_first_p[row], size=num_sims)
+
+        trad_won = trad_points_won / denom > limit
+        only_first_won = only_first_points_won / denom > limit
+        traditional_prob[start:stop] = np.where(played, trad_won.mean(axis=1), 0.0)
+        only_first_prob[start:stop] = np.where(played, only_first_won.mean(axis=1), 0.0)
+        diff_se[start:stop] = np.where(played, difference_se(trad_won, only_first_won), 0.0)
+
+    return traditional_prob, only_first_prob, diff_se, None
+
+def simulate_adaptive(first_in_pct, first_win_pct, second_win_pct, service_points, best_of, batch_sims=200,
+                      max_sims=10_000, engine='vectorized', memory_budget=DEFAULT_MEMORY_BUDGET, rng=None,
+                      keys=None, opponent_p=None, variance_reduction='independent', return_set_scores=False):
+    """
+    simulate_batch in rounds of batch_sims, until each row's answer is clear.
+
+    After every round, rows whose interval (difference +- CONFIDENCE_Z standard
+    errors) lies entirely above +FLIP_THRESHOLD, below -FLIP_THRESHOLD or
+    between the two are done; the rest get another round, up to max_sims.
+    Clear-cut rows stop after one round and borderline ones get up to max_sims,
+    so total work follows the actual uncertainty. Rounds draw from
+    performance_rng streams of 'key#round'. Engines without sampling run once.
+
+    Returns:
+        (traditional_prob, only_first_prob, diff_se, num_sims) with num_sims
+        the simulations each row used (0 for engines without sampling), plus
+        the set-score shares over all of a row's rounds if return_set_scores
+        is set (see simulate_batch)
+    """
+    first_in_pct = np.asarray(first_in_pct, dtype=float)
+    first_win_pct = np.asarray(first_win_pct, dtype=float)
+    second_win_pct = np.asarray(second_win_pct, dtype=float)
+    service_points = np.asarray(service_points, dtype=np.int64)
+    best_of = np.broadcast_to(np.asarray(best_of), service_points.shape)
+    num_rows = len(service_points)
+    if opponent_p is not None:
+        opponent_p = np.broadcast_to(np.asarray(opponent_p, dtype=float), service_points.shape)
+
+    if engine not in SAMPLING_ENGINES:
+        result = simulate_batch(first_in_pct, first_win_pct, second_win_pct, service_points, best_of,
+                                engine=engine, memory_budget=memory_budget, opponent_p=opponent_p, return_se=True,
+                                return_set_scores=return_set_scores)
+        return (*result[:3], np.zeros(num_rows, dtype=np.int64), *result[3:])
+
+    antithetic = variance_reduction == 'antithetic'
+    if antithetic and (batch_sims % 2 or max_sims % 2):
+        raise ValueError(f"Antithetic pairs need even batch and maximum simulation counts, "
+                         f"got {batch_sims} and {max_sims}")
+
+    trad_wins = np.zeros(num_rows)
+    only_first_wins = np.zeros(num_rows)
+    num_sims = np.zeros(num_rows, dtype=np.int64)
+    # Running sums over independent samples of the difference (antithetic pairs count as one)
+    samples = np.zeros(num_rows, dtype=np.int64)
+    diff_sum = np.zeros(num_rows)
+    diff_squares = np.zeros(num_rows)
+    diff_se = np.zeros(num_rows)
+    set_score_sums = np.zeros((num_rows, 2, len(SET_SCORE_LABELS))) if return_set_scores else None
+
+    active = np.arange(num_rows)
+    round_index = 0
+    while active.size:
+        sims = min(batch_sims, max_sims - int(num_sims[active[0]]))
+        trad, only_first, se, *set_scores = simulate_batch(
+            first_in_pct[active], first_win_pct[active], second_win_pct[active], service_points[active],
+            best_of[active], num_sims=sims, engine=engine, memory_budget=memory_budget, rng=rng,
+            keys=None if keys is None else [f"{keys[row]}#{round_index}" for row in active],
+            opponent_p=None if opponent_p is None else opponent_p[active],
+            variance_reduction=variance_reduction, return_se=True, return_set_scores=return_set_scores
+        )
+        if return_set_scores:
+            set_score_sums[active] += set_scores[0] * sims
+        count = sims // 2 if antithetic else sims
+        diff = only_first - trad
+        trad_wins[active] += trad * sims
+        only_first_wins[active] += only_first * sims
+        num_sims[active] += sims
+        samples[active] += count
+        diff_sum[active] += diff * count
+        # Sum of squared samples, recovered from the round's mean and standard error
+        diff_squares[active] += se**2 * count * (count - 1) + diff**2 * count
+
+        n = samples[active]
+        mean = diff_sum[active] / n
+        variance = np.maximum(diff_squares[active] - n * mean**2, 0) / np.maximum(n - 1, 1)
+        diff_se[active] = np.sqrt(variance / n)
+        low = mean - CONFIDENCE_Z * diff_se[active]
+        high = mean + CONFIDENCE_Z * diff_se[active]
+        clear = (low > FLIP_THRESHOLD) | (high < -FLIP_THRESHOLD) | ((low > -FLIP_THRESHOLD) & (high < FLIP_THRESHOLD))
+        active = active[~clear & (num_sims[active] < max_sims)]
+        round_index += 1
+
+    result = (trad_wins / num_sims, only_first_wins / num_sims, diff_se, num_sims)
+    if return_set_scores:
+        result += (set_score_sums / num_sims[:, None, None],)
+    return result
+
+class SimulationCache:
+    """
+    Content-keyed cache of simulated probabilities, the standard error of their
+    difference, the number of simulations behind them and ('match' engine) the
+    set-score shares.
+
+    Keys are the raw integer serve counts (1stIn, 1stWon, 2ndWon, svpt, best_of,
+    plus the opponent's serve points won and played for OPPONENT_ENGINES),
+    which repeat often in short matches. Lookups go through an in-memory LRU and
+    then an optional SQLite file. The file records the engine, ENGINE_VERSION,
+    simulation count, variance reduction, adaptive settings and seed it was
+    built with and is emptied when they change.
+    """
+
+    # Bump when the results table's columns change; part of the signature
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=None, engine='vectorized', num_sims=1000, max_entries=200_000,
+                 variance_reduction='independent', adaptive_batch=None):
+        adaptive = 'fixed' if adaptive_batch is None else f"adaptive{adaptive_batch}@{FLIP_THRESHOLD}/{CONFIDENCE_Z}"
+        self.signature = (f"{engine}:v{ENGINE_VERSION}:{num_sims}:{variance_reduction}:{adaptive}:{BASE_SEED}"
+                          f":s{self.SCHEMA_VERSION}")
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(path), timeout=60)
+            # Check and reset under the write lock: --jobs workers open the same file, and one that
+            # read the old signature must not drop rows another has already written under the new one
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'signature'").fetchone()
+            if row is None or row[0] != self.signature:
+                # Recreated rather than emptied, so files from before a column was added are upgraded
+                self.db.execute("DROP TABLE IF EXISTS results")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('signature', ?)", (self.signature,))
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, traditional REAL, "
+                            "only_first REAL, diff_se REAL, num_sims INTEGER, set_scores BLOB)")
+            self.db.commit()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """{key: (traditional_prob, only_first_prob, diff_se, num_sims, set_scores)} for the keys that are cached"""
+        found = {}
+        remaining = []
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[key] = self.memory[key]
+                self.memory_hits += 1
+            else:
+                remaining.append(key)
+
+        if self.db is not None:
+            for start in range(0, len(remaining), 500):
+                batch = remaining[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.db.execute(
+                    f"SELECT key, traditional, only_first, diff_se, num_sims, set_scores FROM results "
+                    f"WHERE key IN ({placeholders})", batch)
+                for key, traditional, only_first, diff_se, num_sims, set_scores in rows:
+                    if set_scores is not None:
+                        set_scores = np.frombuffer(set_scores, dtype=np.float64).reshape(2, -1)
+                    found[key] = (traditional, only_first, diff_se, num_sims, set_scores)
+                    self._remember(key, found[key])
+                    self.disk_hits += 1
+
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store {key: (traditional_prob, only_first_prob, diff_se, num_sims, set_scores or None)}"""
+        for key, value in items.items():
+            self._remember(key, value)
+        if self.db is not None and items:
+            self.db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", [
+                (key, float(t), float(o), float(se), int(n),
+                 None if scores is None else np.asarray(scores, dtype=np.float64).tobytes())
+                for key, (t, o, se, n, scores) in items.items()
+            ])
+            self.db.commit()
+
+    def stats(self):
+        return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+def format_cache_stats(stats):
+    """One-line hit/miss summary for SimulationCache.stats() (or several summed)"""
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    hits = stats['memory_hits'] + stats['disk_hits']
+    rate = hits / lookups * 100 if lookups else 0.0
+    return (f"Simulation cache: {hits:,}/{lookups:,} hits ({rate:.1f}%), "
+            f"{stats['memory_hits']:,} memory, {stats['disk_hits']:,} disk, {stats['misses']:,} misses")
+
+def simulate_counts(first_in, first_won, second_won, svpt, best_of, num_sims=1000, engine='vectorized',
+                    memory_budget=DEFAULT_MEMORY_BUDGET, cache=None, opp_points_won=None, opp_svpt=None,
+                    variance_reduction='independent', return_se=False, adaptive_batch=None, return_sims=False,
+                    return_set_scores=False):
+    """
+    simulate_batch from raw integer serve counts, with optional caching.
+
+    opp_points_won / opp_svpt are the opponent's service points won and played,
+    used by the OPPONENT_ENGINES (and then part of the cache key). With
+    adaptive_batch set, rows are simulated by simulate_adaptive in rounds of
+    that many simulations and num_sims is the per-row maximum.
+
+    Identical count tuples are simulated once, seeded by the tuple itself
+    (performance_rng of the cache key), so a value doesn't depend on which
+    match produced it or on whether a cache is used. With a SimulationCache,
+    tuples simulated before come from the cache.
+
+    Returns:
+        (traditional_prob, only_first_prob) as float arrays, plus the standard
+        error of their difference if return_se is set (see simulate_batch) and
+        the simulations each row used if return_sims is set (0 for engines
+        without sampling) and the set-score shares if return_set_scores is set
+        ('match' engine only, see simulate_batch)
+    """
+    if return_set_scores and engine != 'match':
+        raise ValueError(f"Set scores are only simulated by the 'match' engine, not {engine!r}")
+    first_in = np.asarray(first_in, dtype=float)
+    first_won = np.asarray(first_won, dtype=float)
+    second_won = np.asarray(second_won, dtype=float)
+    svpt = np.asarray(svpt, dtype=float)
+    best_of = np.broadcast_to(np.asarray(best_of), svpt.shape)
+    with_opponent = engine in OPPONENT_ENGINES and opp_svpt is not None
+    if with_opponent:
+        opp_points_won = np.asarray(opp_points_won, dtype=float)
+        opp_svpt = np.asarray(opp_svpt, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            opponent_p = np.where(opp_svpt > 0, opp_points_won / opp_svpt, np.nan)
+    else:
+        opponent_p = None
+
+    # The 'match' engine's set scores come with every simulation, so cached entries always have them
+    with_set_scores = engine == 'match'
+
+    def simulate(rows, row_keys):
+        fixed_sims = num_sims if engine in SAMPLING_ENGINES else 0
+        args = (first_in[rows] / svpt[rows], first_won[rows] / first_in[rows],
+                second_won[rows] / (svpt[rows] - first_in[rows]), svpt[rows].astype(np.int64), best_of[rows])
+        row_opponent_p = None if opponent_p is None else opponent_p[rows]
+        if adaptive_batch is None:
+            result = simulate_batch(*args, num_sims=num_sims, engine=engine, memory_budget=memory_budget,
+                                    keys=row_keys, opponent_p=row_opponent_p, variance_reduction=variance_reduction,
+                                    return_se=True, return_set_scores=with_set_scores)
+            result = (*result[:3], np.full(len(result[0]), fixed_sims, dtype=np.int64), *result[3:])
+        else:
+            result = simulate_adaptive(*args, batch_sims=adaptive_batch, max_sims=num_sims, engine=engine,
+                                       memory_budget=memory_budget, keys=row_keys, opponent_p=row_opponent_p,
+                                       variance_reduction=variance_reduction, return_set_scores=with_set_scores)
+        return result if with_set_scores else (*result, None)
+
+    def select(trad, only_first, diff_se, sims, set_scores):
+        return ((trad, only_first) + ((diff_se,) if return_se else ()) + ((sims,) if return_sims else ())
+                + ((set_scores,) if return_set_scores else ()))
+
+    param_keys = pd.Series([
+        f"{int(a)}|{int(b)}|{int(c)}|{int(d)}|{int(e)}"
+        for a, b, c, d, e in zip(first_in, first_won, second_won, svpt, best_of)
+    ])
+    if with_opponent:
+        param_keys += pd.Series([f"|{int(won)}|{int(played)}" for won, played in zip(opp_points_won, opp_svpt)])
+    codes, unique_keys = pd.factorize(param_keys)
+    unique_keys = list(unique_keys)
+    first_rows = np.unique(codes, return_index=True)[1]
+
+    found = {}
+    if cache is not None:
+        found = cache.get_many(unique_keys)
+        # Repeats of a tuple within this batch are served from the same entry
+        cache.memory_hits += len(codes) - len(unique_keys)
+    todo = [i for i, key in enumerate(unique_keys) if key not in found]
+    if todo:
+        trad, only_first, diff_se, sims, set_scores = simulate(first_rows[todo], [unique_keys[i] for i in todo])
+        if set_scores is None:
+            set_scores = [None] * len(todo)
+        new_items = {unique_keys[i]: (t, o, se, n, scores)
+                     for i, t, o, se, n, scores in zip(todo, trad, only_first, diff_se, sims, set_scores)}
+        if cache is not None:
+            cache.put_many(new_items)
+        found.update(new_items)
+
+    unique = [np.array([found[key][field] for key in unique_keys]) for field in range(4)]
+    unique[3] = unique[3].astype(np.int64)
+    if return_set_scores:
+        set_scores = np.array([found[key][4] for key in unique_keys])
+        unique.append(set_scores.reshape(len(unique_keys), 2, len(SET_SCORE_LABELS)))
+    else:
+        unique.append(None)
+    return select(*(None if values is None else values[codes] for values in unique))
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Site Data
+Encoding of the match records embedded in tennis_player_view-embedded.html
+and written to data.json, the per-player summary and match shards the page
+loads lazily, and the content-hashed, precompressed copies of them listed in
+the site manifest
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Artifacts are only precompressed with gzip (warned about once per process)
+
+_brotli_warned = False
+
+COLUMNAR_VERSION = 2
+SUMMARY_VERSION = 2
+
+# Record field -> string table it is dictionary-encoded against (player and opponent share one)
+STRING_FIELDS = {
+    'tour': 'tours',
+    'p': 'players',
+    'o': 'players',
+    't': 'tournaments',
+    'd': 'dates',
+    'b': 'formats',
+    's': 'surfaces',
+    'sc': 'scores',
+}
+
+# Percentages, stored as integers in units of 1/FIXED_POINT_SCALE (records are rounded to 2 decimals)
+FIXED_POINT_FIELDS = ('fi', 'fw', 'sw', 'bp', 'sd')
+FIXED_POINT_SCALE = 100
+
+# 0/1 flags, stored as is
+FLAG_FIELDS = ('w', 'ob', 'cf')
+
+# Integer counts, stored as is
+COUNT_FIELDS = ('ns',)
+
+def encode_columnar(records):
+    """
+    Columnar form of a list of site records: one array per field instead of
+    one object per record.
+
+    String fields become indexes into shared string tables and percentages
+    become fixed-point integers, e.g.
+
+        {"format": "columnar", "version": 2, "length": 2, "scale": 100,
+         "strings": {"players": ["A", "B"], ...},
+         "columns": {"p": [0, 1], "o": [1, 0], "fi": [7027, 6105], ...}}
+
+    decodeMatchData in the page (and decode_columnar) turn it back into records.
+    """
+    field_order = list(STRING_FIELDS) + list(FIXED_POINT_FIELDS) + list(FLAG_FIELDS) + list(COUNT_FIELDS)
+    df = pd.DataFrame.from_records(records, columns=field_order)
+
+    strings = {}
+    columns = {}
+    for table in dict.fromkeys(STRING_FIELDS.values()):
+        fields = [field for field, name in STRING_FIELDS.items() if name == table]
+        values = pd.concat([df[field] for field in fields], ignore_index=True)
+        codes, uniques = pd.factorize(values.fillna('').astype(str), sort=True)
+        strings[table] = uniques.tolist()
+        for i, field in enumerate(fields):
+            columns[field] = codes[i * len(df):(i + 1) * len(df)].tolist()
+
+    for field in FIXED_POINT_FIELDS:
+        columns[field] = np.round(df[field].to_numpy(dtype=float) * FIXED_POINT_SCALE).astype(np.int64).tolist()
+    for field in FLAG_FIELDS + COUNT_FIELDS:
+        columns[field] = df[field].to_numpy(dtype=np.int64).tolist()
+
+    return {
+        'format': 'columnar',
+        'version': COLUMNAR_VERSION,
+        'length': len(df),
+        'scale': FIXED_POINT_SCALE,
+        'strings': strings,
+        'columns': columns,
+    }
+
+def decode_columnar(data):
+    """Records from encode_columnar output (a list of records is returned unchanged)"""
+    if isinstance(data, list):
+        return data
+    strings, columns, scale = data['strings'], data['columns'], data['scale']
+    decoded = {}
+    for field, table in STRING_FIELDS.items():
+        decoded[field] = [strings[table][code] for code in columns[field]]
+    for field in FIXED_POINT_FIELDS:
+        decoded[field] = [value / scale for value in columns[field]]
+    for field in FLAG_FIELDS:
+        decoded[field] = columns[field]
+    for field in COUNT_FIELDS:
+        if field in columns:  # Not in version 1 data
+            decoded[field] = columns[field]
+    return [dict(zip(decoded, values)) for values in zip(*decoded.values())]
+
+# Players' matches are split across this many shard files, by a hash of the player name
+SHARD_COUNT = 32
+SHARD_PATH = 'data/matches-{:02d}.json'  # Relative to the site directory
+
+def player_shard(player, shard_count=SHARD_COUNT):
+    """Shard holding player's matches; stable across runs and Python processes"""
+    digest = hashlib.sha1(str(player).encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') % shard_count
+
+def shard_records(records, shard_count=SHARD_COUNT):
+    """{shard: records} for the shards that have any records"""
+    shards = {}
+    for record in records:
+        shards.setdefault(player_shard(record['p'], shard_count), []).append(record)
+    return shards
+
+def player_summary(records, shard_count=SHARD_COUNT):
+    """
+    The totals the player list shows, precomputed for every player, tour,
+    surface and format (best of) combination, in a columnar layout like
+    encode_columnar:
+
+        {"format": "players", "version": 2, "length": 2, "scale": 100,
+         "shards": ["data/matches-00.json", ...],
+         "strings": {"players": [...], "tours": [...], "surfaces": [...], "formats": [...]},
+         "columns": {"p": [...], "tour": [...], "s": [...], "b": [...], "shard": [...],
+                     "n": [...], "better": [...], "bp": [...], "pw": [...], "pl": [...]}}
+
+    A player's totals for any filter are the sums over their matching rows.
+
+    n is the number of matches, better the number where only 1st serves would
+    have been better, bp the sum of the benefit (fixed point), and pw / pl the
+    simulated potential wins (lost, but confidently better) and losses (won,
+    but confidently worse). shard indexes into shards.
+    """
+    df = pd.DataFrame.from_records(records, columns=['p', 'tour', 's', 'b', 'w', 'bp', 'ob', 'cf'])
+    for field in ('p', 'tour', 's', 'b'):
+        df[field] = df[field].fillna('').astype(str)
+    df['bp'] = np.round(df['bp'].to_numpy(dtype=float) * FIXED_POINT_SCALE).astype(np.int64)
+    confident = df['cf'] == 1
+    df['pw'] = (confident & (df['w'] == 0) & (df['bp'] > 0)).astype(np.int64)
+    df['pl'] = (confident & (df['w'] == 1) & (df['bp'] < 0)).astype(np.int64)
+
+    rows = df.groupby(['p', 'tour', 's', 'b'], sort=True).agg(
+        n=('ob', 'size'), better=('ob', 'sum'), bp=('bp', 'sum'), pw=('pw', 'sum'), pl=('pl', 'sum'),
+    ).reset_index()
+
+    strings = {}
+    columns = {}
+    for field, table in (('p', 'players'), ('tour', 'tours'), ('s', 'surfaces'), ('b', 'formats')):
+        codes, uniques = pd.factorize(rows[field], sort=True)
+        strings[table] = uniques.tolist()
+        columns[field] = codes.tolist()
+    columns['shard'] = [player_shard(player, shard_count) for player in rows['p']]
+    for column in ('n', 'better', 'bp', 'pw', 'pl'):
+        columns[column] = rows[column].astype(np.int64).tolist()
+
+    return {
+        'format': 'players',
+        'version': SUMMARY_VERSION,
+        'length': len(rows),
+        'scale': FIXED_POINT_SCALE,
+        'shards': [SHARD_PATH.format(shard) for shard in range(shard_count)],
+        'strings': strings,
+        'columns': columns,
+    }
+
+# Lines delimiting a generated `const NAME = ...;` block in the page template
+DATA_BEGIN_MARKER = '// BEGIN {}'
+DATA_END_MARKER = '// END {}'
+
+# Read size for the template; the old data block is skipped in pieces of this size
+_READ_SIZE = 1 << 16
+
+def _atomic_writer(path, mode='w'):
+    """Open a temp file next to path; call .replace() on the result once it's complete"""
+    path = Path(path)
+    tmp = tempfile.NamedTemporaryFile(mode, encoding=None if 'b' in mode else 'utf-8', dir=path.parent,
+                                      prefix=f'.{path.name}.', suffix='.tmp', delete=False)
+    os.chmod(tmp.name, 0o644)  # mkstemp files are private; these get served
+    return tmp, Path(tmp.name)
+
+def write_json_atomic(path, data):
+    """json.dump data (compact) to path via a temp file and rename"""
+    tmp, tmp_path = _atomic_writer(path)
+    try:
+        with tmp:
+            json.dump(data, tmp, separators=(',', ':'))
+        tmp_path.replace(path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def embed_data(template_path, output_path, blocks):
+    """
+    Write the page at template_path to output_path with data embedded as JS constants.
+
+    blocks maps constant names to data. The template is copied line by line;
+    everything between the `// BEGIN NAME` and `// END NAME` lines is replaced
+    by `const NAME = <json>;`, which is serialized straight into the output.
+    Nothing in the old block is parsed, so its size and contents don't matter.
+    The output is written to a temp file and renamed, so output_path may be
+    the template itself.
+
+    Returns the number of bytes written.
+    """
+    template_path = Path(template_path)
+    output_path = Path(output_path)
+    begin_markers = {DATA_BEGIN_MARKER.format(name): name for name in blocks}
+    written = set()
+    tmp, tmp_path = _atomic_writer(output_path)
+    try:
+        with tmp, open(template_path, encoding='utf-8') as src:
+            inside = None  # Name of the block being skipped
+            at_line_start = True
+            while True:
+                piece = src.readline(_READ_SIZE)
+                if not piece:
+                    break
+                is_line_start = at_line_start
+                at_line_start = piece.endswith('\n')
+                marker = piece.strip() if is_line_start else ''
+
+                if inside is None:
+                    tmp.write(piece)
+                    name = next((name for begin, name in begin_markers.items()
+                                 if marker == begin or marker.startswith(begin + ' ')), None)
+                    if name is not None:
+                        indent = piece[:len(piece) - len(piece.lstrip())]
+                        tmp.write(f'{indent}const {name} = ')
+                        json.dump(blocks[name], tmp, separators=(',', ':'))
+                        tmp.write(';\n')
+                        inside = name
+                elif marker.startswith(DATA_END_MARKER.format(inside)):
+                    tmp.write(piece)
+                    written.add(inside)
+                    inside = None
+
+            missing = [name for name in blocks if name not in written]
+            if missing:
+                raise ValueError(f"{template_path} has no complete '{DATA_BEGIN_MARKER.format(missing[0])}' ... "
+                                 f"'{DATA_END_MARKER.format(missing[0])}' block")
+        tmp_path.replace(output_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return output_path.stat().st_size
+
+# Site files listing every artifact's content-hashed name (see write_artifact)
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+HASH_LENGTH = 12  # Hex digits of the SHA-256 in content-hashed names
+_HASHED_NAME = re.compile(rf'^.+\.[0-9a-f]{{{HASH_LENGTH}}}\.[^.]+(\.gz|\.br)?$')
+
+def _write_bytes_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp, tmp_path = _atomic_writer(path, 'wb')
+    try:
+        with tmp:
+            tmp.write(data)
+        tmp_path.replace(path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def _precompress(path, body, overwrite=True):
+    """
+    Write path.gz (and path.br if brotli is installed) next to path; returns the
+    encodings available. Content-hashed files pass overwrite=False, since an
+    existing copy of the same name already has the right content.
+    """
+    global _brotli_warned
+    compressors = {'gzip': ('.gz', lambda: gzip.compress(body, compresslevel=9, mtime=0))}  # mtime=0: reproducible
+    if brotli is not None:
+        compressors['br'] = ('.br', lambda: brotli.compress(body, quality=11))
+    elif not _brotli_warned:
+        print("  brotli is not installed (pip install brotli), so only .gz copies are written")
+        _brotli_warned = True
+    for suffix, compress in compressors.values():
+        compressed_path = path.with_name(path.name + suffix)
+        if overwrite or not compressed_path.exists():
+            _write_bytes_atomic(compressed_path, compress())
+    return list(compressors)
+
+def write_artifact(site_dir, name, data):
+    """
+    Write data as JSON to a content-hashed file for the logical name (relative
+    to site_dir), e.g. data/matches-07.json -> data/matches-07.3f2a9c01d4e5.json,
+    with gzip and brotli copies next to it, so a changed file always gets a new
+    URL and unchanged ones can be cached forever.
+
+    Returns the manifest entry: {"path", "sha256", "size", "encodings"}.
+    """
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()
+    logical = Path(name)
+    path = logical.with_name(f"{logical.stem}.{digest[:HASH_LENGTH]}{logical.suffix}")
+    full_path = Path(site_dir) / path
+    if not full_path.exists():
+        _write_bytes_atomic(full_path, body)
+    encodings = _precompress(full_path, body, overwrite=False)
+    return {'path': path.as_posix(), 'sha256': digest, 'size': len(body), 'encodings': encodings}
+
+def precompress_file(site_dir, name):
+    """Precompressed copies of a file that keeps its name (e.g. the page); returns its manifest entry"""
+    path = Path(site_dir) / name
+    body = path.read_bytes()
+    encodings = _precompress(path, body)
+    return {'path': Path(name).as_posix(), 'sha256': hashlib.sha256(body).hexdigest(),
+            'size': len(body), 'encodings': encodings}
+
+def write_manifest(site_dir, files):
+    """
+    Write the manifest for {logical name: manifest entry} and delete the hashed
+    files (and their compressed copies) that the previous manifest listed and
+    this one doesn't. Nothing else in site_dir is touched, so unrelated files
+    that happen to look content-hashed survive.
+    """
+    site_dir = Path(site_dir)
+    keep = set()
+    for entry in files.values():
+        keep.add(entry['path'])
+        keep.update(f"{entry['path']}{suffix}" for suffix in ('.gz', '.br'))
+
+    try:
+        previous = json.loads((site_dir / MANIFEST_NAME).read_text(encoding='utf-8')).get('files', {})
+    except (OSError, ValueError, AttributeError):
+        previous = {}  # No (readable) manifest: nothing is known to be ours
+
+    write_json_atomic(site_dir / MANIFEST_NAME, {'version': MANIFEST_VERSION, 'files': dict(sorted(files.items()))})
+
+    root = site_dir.resolve()
+    for entry in previous.values():
+        for name in (entry['path'], f"{entry['path']}.gz", f"{entry['path']}.br"):
+            path = (site_dir / name).resolve()
+            # Only content-hashed names inside site_dir; the page keeps its name across builds
+            if name not in keep and _HASHED_NAME.match(path.name) and path.is_relative_to(root):
+                path.unlink(missing_ok=True)
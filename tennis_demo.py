@@ -5,57 +5,11 @@ Shows what the analysis output would look like
 """
 
 import pandas as pd
-import numpy as np
 
-# Create sample data mimicking ATP match statistics
-np.random.seed(42)
+from sample_matches import generate_sample_matches
 
-# Generate 100 sample matches
-sample_data = []
-
-players = ["Carlos Alcaraz", "Novak Djokovic", "Jannik Sinner", "Daniil Medvedev", 
-           "Alexander Zverev", "Andrey Rublev", "Taylor Fritz", "Hubert Hurkacz",
-           "Stefanos Tsitsipas", "Casper Ruud", "Holger Rune", "Alex de Minaur"]
-
-tournaments = ["Australian Open", "Roland Garros", "Wimbledon", "US Open", 
-               "Miami", "Indian Wells", "Madrid", "Rome"]
-
-surfaces = ["Hard", "Clay", "Grass"]
-
-for i in range(100):
-    winner = np.random.choice(players)
-    loser = np.random.choice([p for p in players if p != winner])
-    
-    # Winner stats - make some players have strong first serves
-    w_svpt = np.random.randint(80, 150)
-    w_1stIn = int(w_svpt * np.random.uniform(0.55, 0.75))  # 55-75% first serve in
-    w_1stWon = int(w_1stIn * np.random.uniform(0.65, 0.85))  # 65-85% win on 1st serve
-    w_2ndWon = int((w_svpt - w_1stIn) * np.random.uniform(0.35, 0.55))  # 35-55% win on 2nd
-    
-    # Loser stats
-    l_svpt = np.random.randint(80, 150)
-    l_1stIn = int(l_svpt * np.random.uniform(0.55, 0.75))
-    l_1stWon = int(l_1stIn * np.random.uniform(0.60, 0.80))
-    l_2ndWon = int((l_svpt - l_1stIn) * np.random.uniform(0.30, 0.50))
-    
-    sample_data.append({
-        'tourney_name': np.random.choice(tournaments),
-        'tourney_date': f"2024{np.random.randint(1,13):02d}{np.random.randint(1,28):02d}",
-        'surface': np.random.choice(surfaces),
-        'round': np.random.choice(['R128', 'R64', 'R32', 'R16', 'QF', 'SF', 'F']),
-        'winner_name': winner,
-        'loser_name': loser,
-        'w_1stIn': w_1stIn,
-        'w_1stWon': w_1stWon,
-        'w_2ndWon': w_2ndWon,
-        'w_svpt': w_svpt,
-        'l_1stIn': l_1stIn,
-        'l_1stWon': l_1stWon,
-        'l_2ndWon': l_2ndWon,
-        'l_svpt': l_svpt
-    })
-
-df = pd.DataFrame(sample_data)
+# Create 100 sample matches mimicking ATP match statistics
+df = generate_sample_matches(100)
 
 # Now analyze using the same logic as the main script
 results = []
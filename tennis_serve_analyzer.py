@@ -15,40 +15,75 @@ import numpy as np
 from pathlib import Path
 import sys
 
+from download_cache import concat_match_frames, fetch_all, format_memory_saving, read_match_csv, read_match_csv_chunks
+from serve_engine import (ENGINES, FLIP_THRESHOLD, SET_SCORE_LABELS, SET_SCORES, SimulationCache,
+                          check_variance_reduction, column_or, difference_se, format_cache_stats, performance_frame,
+                          play_matches, point_win_probs, resolve_best_of, set_score_distribution, simulate_batch,
+                          simulate_counts, simulate_vectorized, strategy_uniforms)
+
 # Configuration
 USE_LOCAL_DATA = True  # Set to True if using local CSV files
 DATA_DIR = Path("./tennis_atp")  # Update this to your data directory
 YEARS = range(2024, 2026)  # 2024-2025 (present)
 BASE_URL = "https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_{}.csv"
+DOWNLOAD_CACHE_DIR = Path("./.cache/downloads")  # Downloaded CSVs, revalidated with conditional GET
+PARSED_CACHE_DIR = Path("./.cache/parsed")  # Parsed CSVs in binary form, keyed by file hash
+OFFLINE = False  # Only use CSVs already in DOWNLOAD_CACHE_DIR
+
+# Streaming mode: analyze each year in chunks and append results to disk as they are
+# produced, so peak memory doesn't grow with the number of seasons
+STREAMING = False
+CHUNK_SIZE = 5000  # Matches per chunk in streaming mode
+OUTPUT_DIR = Path('./tennis_analysis_results')
 
 # Monte Carlo simulation settings
 NUM_SIMULATIONS = 1000  # Number of simulations per match
+SIM_ENGINE = 'vectorized'  # 'vectorized' (batched), 'exact' (binomial CDF), 'markov' (game/set/match
+                           # recursion against the opponent's serve; both without sampling), 'match' (Monte
+                           # Carlo over games and sets against the opponent's serve) or 'loop' (per call only)
+# 'match' engine runs: 'independent' draws per strategy, or 'crn' / 'antithetic' (shared, and
+# mirrored, draws), which shrink the noise in sim_prob_diff for the same NUM_SIMULATIONS
+VARIANCE_REDUCTION = 'independent'
+# Adaptive mode for batch runs: simulate each match in batches of ADAPTIVE_BATCH (e.g. 200) until the
+# confidence interval of sim_prob_diff is clear of the could_flip_result threshold, up to MAX_SIMULATIONS
+ADAPTIVE_BATCH = None
+MAX_SIMULATIONS = 10_000
 np.random.seed(42)  # For reproducibility
+SIM_CACHE_PATH = Path('./tennis_analysis_results/simulations.sqlite')  # None for an in-memory cache only
 
 def download_data():
     """Download ATP match data from GitHub or load from local files"""
     print("Loading ATP match data...")
     dfs = []
     
-    for year in YEARS:
-        try:
-            if USE_LOCAL_DATA:
+    if USE_LOCAL_DATA:
+        for year in YEARS:
+            try:
                 # Load from local CSV
                 filepath = DATA_DIR / f"atp_matches_{year}.csv"
                 if filepath.exists():
-                    df = pd.read_csv(filepath)
+                    df = read_match_csv(filepath, PARSED_CACHE_DIR)
                     dfs.append(df)
                     print(f"  ✓ {year}: {len(df)} matches (local)")
                 else:
                     print(f"  ✗ {year}: File not found at {filepath}")
+            except Exception as e:
+                print(f"  ✗ {year}: {e}")
+    else:
+        # Download all years from GitHub concurrently (unchanged files come from the download cache)
+        urls = {BASE_URL.format(year): year for year in YEARS}
+        by_year = {}
+        def parse(path):
+            return read_match_csv(path, PARSED_CACHE_DIR)
+        
+        for url, status, df, error in fetch_all(urls, parse=parse, cache_dir=DOWNLOAD_CACHE_DIR,
+                                                offline=OFFLINE):
+            if error is not None:
+                print(f"  ✗ {urls[url]}: {error}")
             else:
-                # Download from GitHub
-                url = BASE_URL.format(year)
-                df = pd.read_csv(url)
-                dfs.append(df)
-                print(f"  ✓ {year}: {len(df)} matches (downloaded)")
-        except Exception as e:
-            print(f"  ✗ {year}: {e}")
+                by_year[urls[url]] = df
+                print(f"  ✓ {urls[url]}: {len(df)} matches ({status})")
+        dfs = [by_year[year] for year in YEARS if year in by_year]
     
     if not dfs:
         print("\nERROR: No data loaded!")
@@ -58,20 +93,131 @@ def download_data():
         print("3. Or download individual CSV files from the repo")
         sys.exit(1)
     
-    all_matches = pd.concat(dfs, ignore_index=True)
+    all_matches = concat_match_frames(dfs)
     print(f"\nTotal matches loaded: {len(all_matches):,}")
+    print(f"  {format_memory_saving([all_matches])}, before dropping matches without serve stats")
     return all_matches
 
-def simulate_match_outcome(first_in_pct, first_win_pct, second_win_pct, service_points, best_of=3, num_sims=NUM_SIMULATIONS):
+def iter_match_chunks(chunk_size):
+    """Yield ATP match frames of at most chunk_size rows, one year at a time, without concatenating"""
+    print(f"Streaming ATP match data in chunks of {chunk_size:,}...")
+    if USE_LOCAL_DATA:
+        paths = {}
+        for year in YEARS:
+            filepath = DATA_DIR / f"atp_matches_{year}.csv"
+            if filepath.exists():
+                paths[year] = filepath
+            else:
+                print(f"  ✗ {year}: File not found at {filepath}")
+    else:
+        urls = {BASE_URL.format(year): year for year in YEARS}
+        paths = {}
+        for url, status, path, error in fetch_all(urls, cache_dir=DOWNLOAD_CACHE_DIR, offline=OFFLINE):
+            if error is not None:
+                print(f"  ✗ {urls[url]}: {error}")
+            else:
+                paths[urls[url]] = path
+    
+    # Continue the row index across files, like the concatenated frame in download_data
+    offset = 0
+    for year in sorted(paths):
+        for chunk in read_match_csv_chunks(paths[year], chunk_size):
+            chunk.index = chunk.index - chunk.index[0] + offset
+            offset += len(chunk)
+            yield chunk
+        print(f"  ✓ {year}: done ({offset:,} matches so far)")
+
+def run_streaming(output_dir, chunk_size, sim_cache=None):
+    """
+    Analyze matches chunk by chunk, appending each chunk's results to
+    serve_analysis_all_matches.csv and folding them into a ResultsSummary.
+    """
+    results_path = output_dir / 'serve_analysis_all_matches.csv'
+    summary = ResultsSummary()
+    first_chunk = True
+    for chunk in iter_match_chunks(chunk_size):
+        chunk_results = calculate_serve_advantage(chunk, sim_cache)
+        if chunk_results is None or chunk_results.empty:
+            continue
+        chunk_results.to_csv(results_path, mode='w' if first_chunk else 'a', header=first_chunk, index=False)
+        first_chunk = False
+        summary.update(chunk_results)
+    return summary
+
+def simulate_match_outcome(first_in_pct, first_win_pct, second_win_pct, service_points, best_of=3, num_sims=NUM_SIMULATIONS, engine=SIM_ENGINE,
+                           opponent_point_pct=None, variance_reduction=VARIANCE_REDUCTION):
     """
     Monte Carlo simulation to estimate match win probability with different serving strategies.
     
+    engine='loop' plays every point in Python; engine='vectorized' draws all
+    simulations at once as binomial counts (same distribution, much faster);
+    engine='exact' computes the probabilities from the binomial CDF with no
+    sampling (the win counts are then expected values out of num_sims);
+    engine='markov' plays out games, tiebreaks and sets analytically against an
+    opponent winning opponent_point_pct of their own service points (evenly
+    matched if None), also without sampling. engine='match' plays the same
+    structure out num_sims times and also returns the distribution of final
+    scores in sets for each strategy, and the standard error of only_first_prob -
+    traditional_prob as prob_diff_se; its two strategies are drawn according to
+    variance_reduction ('independent', 'crn' or 'antithetic', see simulate_batch).
+    
     Returns:
         traditional_wins: Number of times player wins with traditional serving (out of num_sims)
         only_first_wins: Number of times player wins with only first serves (out of num_sims)
         traditional_prob: Win probability with traditional serving
         only_first_prob: Win probability with only first serves
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+    check_variance_reduction(engine, variance_reduction, num_sims)
+    
+    if engine == 'match':
+        trad_p, only_first_p = point_win_probs(first_in_pct, first_win_pct, second_win_pct)
+        opponent_p = trad_p if opponent_point_pct is None else opponent_point_pct
+        trad_draws, only_first_draws = strategy_uniforms(1, num_sims, best_of, variance_reduction)
+        result = {'num_simulations': num_sims}
+        outcomes = []
+        for strategy, point_p, draws in (('traditional', trad_p, trad_draws),
+                                         ('only_first', only_first_p, only_first_draws)):
+            won, sets_won, sets_lost = play_matches([point_p], [opponent_p], [best_of], draws)
+            outcomes.append(won)
+            wins = int(won.sum()) if service_points > 0 else 0
+            scores = set_score_distribution(sets_won, sets_lost).iloc[0]
+            result[f'{strategy}_wins'] = wins
+            result[f'{strategy}_prob'] = wins / num_sims
+            # No serve data means no simulated result, as for the wins above
+            result[f'{strategy}_set_scores'] = {label: float(scores[label]) if service_points > 0 else 0.0
+                                                for label in SET_SCORES[best_of]}
+        diff_se = difference_se(*outcomes, antithetic=variance_reduction == 'antithetic')[0]
+        result['prob_diff_se'] = float(diff_se) if service_points > 0 else 0.0
+        return result
+    
+    if engine in ('exact', 'markov'):
+        trad_prob, only_first_prob = simulate_batch(
+            [first_in_pct], [first_win_pct], [second_win_pct], [service_points], [best_of],
+            engine=engine, opponent_p=None if opponent_point_pct is None else [opponent_point_pct]
+        )
+        return {
+            'traditional_wins': float(trad_prob[0]) * num_sims,
+            'only_first_wins': float(only_first_prob[0]) * num_sims,
+            'traditional_prob': float(trad_prob[0]),
+            'only_first_prob': float(only_first_prob[0]),
+            'num_simulations': num_sims
+        }
+    
+    if engine == 'vectorized':
+        traditional_wins, only_first_wins = simulate_vectorized(
+            first_in_pct, first_win_pct, second_win_pct, service_points,
+            best_of=best_of, num_sims=num_sims
+        )
+        return {
+            'traditional_wins': traditional_wins,
+            'only_first_wins': only_first_wins,
+            'traditional_prob': traditional_wins / num_sims,
+            'only_first_prob': only_first_wins / num_sims,
+            'num_simulations': num_sims
+        }
+    
     traditional_wins = 0
     only_first_wins = 0
     
@@ -131,7 +277,7 @@ def simulate_match_outcome(first_in_pct, first_win_pct, second_win_pct, service_
         'num_simulations': num_sims
     }
 
-def calculate_serve_advantage(df):
+def calculate_serve_advantage(df, sim_cache=None):
     """
     Calculate whether players would benefit from only hitting 1st serves
     
@@ -141,6 +287,8 @@ def calculate_serve_advantage(df):
     - 2nd serve win %: w_2ndWon / (w_svpt - w_1stIn)
     
     Condition: 1st_in% × 1st_win% > 2nd_win%
+    
+    sim_cache (a SimulationCache) reuses simulations for identical serve counts.
     """
     print("\nCalculating serve statistics...")
     
@@ -158,160 +306,151 @@ def calculate_serve_advantage(df):
         return None
     
     # Drop rows with missing serve stats
-    df_clean = df.dropna(subset=required_cols).copy()
+    df_clean = df.dropna(subset=required_cols)
     print(f"Matches with complete serve stats: {len(df_clean):,}")
     
-    results = []
-    
-    # Analyze winner's serves
-    for idx, row in df_clean.iterrows():
-        # Winner stats
-        if row['w_svpt'] > 0 and row['w_1stIn'] > 0:
-            first_in_pct = row['w_1stIn'] / row['w_svpt']
-            first_win_pct = row['w_1stWon'] / row['w_1stIn']
-            
-            second_serve_points = row['w_svpt'] - row['w_1stIn']
-            if second_serve_points > 0:
-                second_win_pct = row['w_2ndWon'] / second_serve_points
-                
-                # Calculate expected win rates
-                only_first = first_in_pct * first_win_pct + (1 - first_in_pct) * first_in_pct * first_win_pct
-                traditional = first_in_pct * first_win_pct + (1 - first_in_pct) * second_win_pct
-                
-                # Simplified condition
-                only_first_better = (first_in_pct * first_win_pct) > second_win_pct
-                
-                # Estimate impact on match result
-                # This is a simplified approximation: if service points won changes significantly,
-                # it could flip close matches
-                service_point_diff = (only_first - traditional) * row['w_svpt']
-                
-                # Very rough heuristic: if the match was won and benefit is negative (worse serve),
-                # or if match was lost and benefit is positive (better serve),
-                # check if the point difference could have changed the outcome
-                # This is approximate since we don't know exact game/set scores
-                could_flip_result = abs(service_point_diff) > 10  # Arbitrary threshold
-                
-                # Determine if Grand Slam (Best of 5) or regular tour (Best of 3)
-                # Grand Slams: Australian Open, Roland Garros, Wimbledon, US Open
-                tourney_name = row.get('tourney_name', '').lower()
-                is_grand_slam = any(slam in tourney_name for slam in 
-                                   ['australian open', 'roland garros', 'wimbledon', 'us open', 
-                                    'australian', 'french', 'us open', 'championships'])
-                best_of = 5 if is_grand_slam else 3
-                
-                # Run Monte Carlo simulation
-                sim_results = simulate_match_outcome(
-                    first_in_pct, 
-                    first_win_pct, 
-                    second_win_pct, 
-                    int(row['w_svpt']),
-                    best_of=best_of
-                )
-                
-                # Determine if result would likely flip
-                prob_diff = sim_results['only_first_prob'] - sim_results['traditional_prob']
-                could_flip_result = abs(prob_diff) > 0.15  # If >15% probability difference
-                
-                results.append({
-                    'match_id': row.get('match_id', idx),
-                    'tourney_name': row.get('tourney_name', 'Unknown'),
-                    'tourney_date': row.get('tourney_date', 'Unknown'),
-                    'surface': row.get('surface', 'Unknown'),
-                    'round': row.get('round', 'Unknown'),
-                    'score': row.get('score', 'Unknown'),
-                    'best_of': best_of,
-                    'player': row.get('winner_name', 'Unknown'),
-                    'opponent': row.get('loser_name', 'Unknown'),
-                    'won_match': True,
-                    'first_in_pct': first_in_pct * 100,
-                    'first_win_pct': first_win_pct * 100,
-                    'second_win_pct': second_win_pct * 100,
-                    'only_first_expected': only_first * 100,
-                    'traditional_expected': traditional * 100,
-                    'benefit_pct': (only_first - traditional) * 100,
-                    'only_first_better': only_first_better,
-                    'service_points_played': row['w_svpt'],
-                    'estimated_point_swing': service_point_diff,
-                    'could_flip_result': could_flip_result,
-                    'sim_traditional_prob': sim_results['traditional_prob'] * 100,
-                    'sim_only_first_prob': sim_results['only_first_prob'] * 100,
-                    'sim_prob_diff': prob_diff * 100,
-                    'num_simulations': sim_results['num_simulations']
-                })
+    # Determine Best of 3 or 5 from the best_of / tourney_level columns,
+    # falling back to Grand Slam names (Australian Open, Roland Garros, Wimbledon, US Open)
+    best_of, unresolved = resolve_best_of(df_clean)
+    if unresolved:
+        print(f"No format data for {len(unresolved)} tournaments, assumed best of 3: {', '.join(unresolved)}")
+    
+    # One row per player per match, all serve math as whole-column operations
+    perf = performance_frame(
+        df_clean,
+        match_id=column_or(df_clean, 'match_id', df_clean.index),
+        tourney_name=column_or(df_clean, 'tourney_name', 'Unknown'),
+        tourney_date=column_or(df_clean, 'tourney_date', 'Unknown'),
+        surface=column_or(df_clean, 'surface', 'Unknown'),
+        round=column_or(df_clean, 'round', 'Unknown'),
+        score=column_or(df_clean, 'score', 'Unknown'),
+        best_of=best_of,
+    )
+    if perf.empty:
+        return pd.DataFrame()
+    
+    # Run the Monte Carlo simulation for every performance in one batched call
+    # The 'match' engine also gives the final score in sets, from the same simulated matches
+    with_set_scores = SIM_ENGINE == 'match'
+    trad_prob, only_first_prob, prob_diff_se, num_sims, *set_scores = simulate_counts(
+        perf['first_in'], perf['first_won'], perf['second_won'], perf['svpt'], perf['best_of'],
+        num_sims=NUM_SIMULATIONS if ADAPTIVE_BATCH is None else MAX_SIMULATIONS, engine=SIM_ENGINE,
+        cache=sim_cache, opp_points_won=perf['opp_points_won'], opp_svpt=perf['opp_svpt'],
+        variance_reduction=VARIANCE_REDUCTION, return_se=True, adaptive_batch=ADAPTIVE_BATCH, return_sims=True,
+        return_set_scores=with_set_scores
+    )
+    prob_diff = only_first_prob - trad_prob
+    
+    # Estimate impact on match result: if service points won changes significantly,
+    # it could flip close matches (approximate since we don't know game/set scores)
+    service_point_diff = (perf['only_first'] - perf['traditional']) * perf['svpt']
+    
+    results = pd.DataFrame({
+        'match_id': perf['match_id'],
+        'tourney_name': perf['tourney_name'],
+        'tourney_date': perf['tourney_date'],
+        'surface': perf['surface'],
+        'round': perf['round'],
+        'score': perf['score'],
+        'best_of': perf['best_of'],
+        'player': perf['player'],
+        'opponent': perf['opponent'],
+        'won_match': perf['won'],
+        'first_in_pct': perf['first_in_pct'] * 100,
+        'first_win_pct': perf['first_win_pct'] * 100,
+        'second_win_pct': perf['second_win_pct'] * 100,
+        'only_first_expected': perf['only_first'] * 100,
+        'traditional_expected': perf['traditional'] * 100,
+        'benefit_pct': (perf['only_first'] - perf['traditional']) * 100,
+        'only_first_better': perf['only_first_better'],
+        'service_points_played': perf['svpt'],
+        'estimated_point_swing': service_point_diff,
+        'could_flip_result': np.abs(prob_diff) > FLIP_THRESHOLD,  # If >15% probability difference
+        'sim_traditional_prob': trad_prob * 100,
+        'sim_only_first_prob': only_first_prob * 100,
+        'sim_prob_diff': prob_diff * 100,
+        'sim_prob_diff_se': prob_diff_se * 100,  # Standard error of sim_prob_diff (0 without sampling)
+        'num_simulations': num_sims  # Per match in adaptive mode, 0 without sampling
+    })
+    
+    if with_set_scores:
+        # Final score in sets (% of simulations) for each strategy, e.g. sim_traditional_sets_2-1
+        for index, strategy in enumerate(('traditional', 'only_first')):
+            for label_index, label in enumerate(SET_SCORE_LABELS):
+                results[f'sim_{strategy}_sets_{label}'] = set_scores[0][:, index, label_index] * 100
+    
+    return results
+
+class ResultsSummary:
+    """
+    Mergeable partial aggregates behind analyze_results.
+    
+    A summary of a whole results frame equals the merge of the summaries of its
+    chunks (taken in order), so results can be summarized chunk by chunk without
+    keeping every row in memory.
+    """
+    
+    def __init__(self):
+        self.total = 0
+        self.better = 0
+        self.top = None  # Rows with the largest benefit_pct
+        self.gs_top = None  # Same, best of 5 only
+        self.players = None  # per player: times_better, total_matches, benefit_sum
+        self.surfaces = None  # per surface: times_better, total
+        self.formats = None  # per best_of: times_better, total
+    
+    @classmethod
+    def from_results(cls, results_df):
+        summary = cls()
+        summary.total = len(results_df)
+        summary.better = int(results_df['only_first_better'].sum())
+        summary.top = results_df.nlargest(20, 'benefit_pct')
+        summary.gs_top = results_df[results_df['best_of'] == 5].nlargest(10, 'benefit_pct')
+        summary.players = results_df.groupby('player').agg(
+            times_better=('only_first_better', 'sum'),
+            total_matches=('only_first_better', 'count'),
+            benefit_sum=('benefit_pct', 'sum'))
+        summary.surfaces = results_df.groupby('surface').agg(
+            times_better=('only_first_better', 'sum'), total=('only_first_better', 'count'))
+        summary.formats = results_df.groupby('best_of').agg(
+            times_better=('only_first_better', 'sum'), total=('only_first_better', 'count'))
+        return summary
+    
+    def merge(self, other):
+        """Fold in the summary of the rows that follow this one"""
+        def add(a, b):
+            if a is None:
+                return b
+            return a.add(b, fill_value=0).astype(a.dtypes.to_dict())
+        
+        def largest(a, b, n):
+            if a is None:
+                return b
+            return pd.concat([a, b]).nlargest(n, 'benefit_pct')
         
-        # Loser stats
-        if row['l_svpt'] > 0 and row['l_1stIn'] > 0:
-            first_in_pct = row['l_1stIn'] / row['l_svpt']
-            first_win_pct = row['l_1stWon'] / row['l_1stIn']
-            
-            second_serve_points = row['l_svpt'] - row['l_1stIn']
-            if second_serve_points > 0:
-                second_win_pct = row['l_2ndWon'] / second_serve_points
-                
-                only_first = first_in_pct * first_win_pct + (1 - first_in_pct) * first_in_pct * first_win_pct
-                traditional = first_in_pct * first_win_pct + (1 - first_in_pct) * second_win_pct
-                
-                only_first_better = (first_in_pct * first_win_pct) > second_win_pct
-                
-                service_point_diff = (only_first - traditional) * row['l_svpt']
-                
-                # Determine Best of 3 or 5
-                tourney_name = row.get('tourney_name', '').lower()
-                is_grand_slam = any(slam in tourney_name for slam in 
-                                   ['australian open', 'roland garros', 'wimbledon', 'us open', 
-                                    'australian', 'french', 'us open', 'championships'])
-                best_of = 5 if is_grand_slam else 3
-                
-                # Run Monte Carlo simulation
-                sim_results = simulate_match_outcome(
-                    first_in_pct, 
-                    first_win_pct, 
-                    second_win_pct, 
-                    int(row['l_svpt']),
-                    best_of=best_of
-                )
-                
-                prob_diff = sim_results['only_first_prob'] - sim_results['traditional_prob']
-                could_flip_result = abs(prob_diff) > 0.15
-                
-                results.append({
-                    'match_id': row.get('match_id', idx),
-                    'tourney_name': row.get('tourney_name', 'Unknown'),
-                    'tourney_date': row.get('tourney_date', 'Unknown'),
-                    'surface': row.get('surface', 'Unknown'),
-                    'round': row.get('round', 'Unknown'),
-                    'score': row.get('score', 'Unknown'),
-                    'best_of': best_of,
-                    'player': row.get('loser_name', 'Unknown'),
-                    'opponent': row.get('winner_name', 'Unknown'),
-                    'won_match': False,
-                    'first_in_pct': first_in_pct * 100,
-                    'first_win_pct': first_win_pct * 100,
-                    'second_win_pct': second_win_pct * 100,
-                    'only_first_expected': only_first * 100,
-                    'traditional_expected': traditional * 100,
-                    'benefit_pct': (only_first - traditional) * 100,
-                    'only_first_better': only_first_better,
-                    'service_points_played': row['l_svpt'],
-                    'estimated_point_swing': service_point_diff,
-                    'could_flip_result': could_flip_result,
-                    'sim_traditional_prob': sim_results['traditional_prob'] * 100,
-                    'sim_only_first_prob': sim_results['only_first_prob'] * 100,
-                    'sim_prob_diff': prob_diff * 100,
-                    'num_simulations': sim_results['num_simulations']
-                })
-    
-    return pd.DataFrame(results)
+        self.total += other.total
+        self.better += other.better
+        self.top = largest(self.top, other.top, 20)
+        self.gs_top = largest(self.gs_top, other.gs_top, 10)
+        self.players = add(self.players, other.players)
+        self.surfaces = add(self.surfaces, other.surfaces)
+        self.formats = add(self.formats, other.formats)
+        return self
+    
+    def update(self, results_df):
+        return self.merge(ResultsSummary.from_results(results_df))
 
-def analyze_results(results_df):
-    """Generate summary statistics"""
+def analyze_results(results_df, summary=None):
+    """Generate summary statistics (from results_df, or a ResultsSummary built chunk by chunk)"""
+    if summary is None:
+        summary = ResultsSummary.from_results(results_df)
+    
     print("\n" + "="*80)
     print("ANALYSIS RESULTS")
     print("="*80)
     
-    total_performances = len(results_df)
-    only_first_better_count = results_df['only_first_better'].sum()
+    total_performances = summary.total
+    only_first_better_count = summary.better
     pct_better = (only_first_better_count / total_performances) * 100
     
     print(f"\nTotal player performances analyzed: {total_performances:,}")
@@ -321,7 +460,7 @@ def analyze_results(results_df):
     print("\n" + "-"*80)
     print("TOP 20 EXAMPLES - Biggest Advantage from Only Hitting 1st Serves")
     print("-"*80)
-    top_20 = results_df.nlargest(20, 'benefit_pct')
+    top_20 = summary.top
     for idx, row in top_20.iterrows():
         print(f"\n{row['player']} vs {row['opponent']}")
         print(f"  Tournament: {row['tourney_name']} ({row['tourney_date']}, {row['surface']})")
@@ -335,11 +474,9 @@ def analyze_results(results_df):
     print("PLAYERS WHO MOST FREQUENTLY BENEFIT (min 50 matches)")
     print("-"*80)
     
-    player_stats = results_df.groupby('player').agg({
-        'only_first_better': ['sum', 'count'],
-        'benefit_pct': 'mean'
-    }).reset_index()
-    player_stats.columns = ['player', 'times_better', 'total_matches', 'avg_benefit']
+    player_stats = summary.players.reset_index()
+    player_stats['avg_benefit'] = player_stats['benefit_sum'] / player_stats['total_matches']
+    player_stats = player_stats[['player', 'times_better', 'total_matches', 'avg_benefit']]
     player_stats['pct_better'] = (player_stats['times_better'] / player_stats['total_matches']) * 100
     player_stats = player_stats[player_stats['total_matches'] >= 50]
     player_stats = player_stats.sort_values('pct_better', ascending=False)
@@ -351,10 +488,7 @@ def analyze_results(results_df):
     print("BREAKDOWN BY SURFACE")
     print("-"*80)
     
-    surface_stats = results_df.groupby('surface').agg({
-        'only_first_better': ['sum', 'count']
-    }).reset_index()
-    surface_stats.columns = ['surface', 'times_better', 'total']
+    surface_stats = summary.surfaces.reset_index()
     surface_stats['pct_better'] = (surface_stats['times_better'] / surface_stats['total']) * 100
     surface_stats = surface_stats.sort_values('pct_better', ascending=False)
     
@@ -365,10 +499,7 @@ def analyze_results(results_df):
     print("BREAKDOWN BY MATCH FORMAT")
     print("-"*80)
     
-    bo_stats = results_df.groupby('best_of').agg({
-        'only_first_better': ['sum', 'count']
-    }).reset_index()
-    bo_stats.columns = ['best_of', 'times_better', 'total']
+    bo_stats = summary.formats.reset_index()
     bo_stats['pct_better'] = (bo_stats['times_better'] / bo_stats['total']) * 100
     bo_stats['format'] = bo_stats['best_of'].apply(lambda x: f'Best of {int(x)}' if x in [3, 5] else 'Unknown')
     bo_stats = bo_stats[['format', 'times_better', 'total', 'pct_better']]
@@ -380,13 +511,14 @@ def analyze_results(results_df):
     print("GRAND SLAM MATCHES (Best of 5)")
     print("-"*80)
     
-    gs_df = results_df[results_df['best_of'] == 5]
-    if len(gs_df) > 0:
-        print(f"\nTotal Grand Slam performances: {len(gs_df):,}")
-        print(f"Would benefit from only 1st serves: {gs_df['only_first_better'].sum():,} ({(gs_df['only_first_better'].sum()/len(gs_df)*100):.2f}%)")
+    gs_total = int(summary.formats['total'].get(5, 0))
+    if gs_total > 0:
+        gs_better = int(summary.formats['times_better'].get(5, 0))
+        print(f"\nTotal Grand Slam performances: {gs_total:,}")
+        print(f"Would benefit from only 1st serves: {gs_better:,} ({(gs_better/gs_total*100):.2f}%)")
         
         print("\nTop 10 Grand Slam examples:")
-        top_gs = gs_df.nlargest(10, 'benefit_pct')
+        top_gs = summary.gs_top
         for idx, row in top_gs.iterrows():
             print(f"\n{row['player']} vs {row['opponent']}")
             print(f"  {row['tourney_name']} - {row['round']} ({row['tourney_date']})")
@@ -397,20 +529,41 @@ def analyze_results(results_df):
     return results_df, player_stats
 
 def main():
+    output_dir = OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+    sim_cache = SimulationCache(SIM_CACHE_PATH, engine=SIM_ENGINE,
+                                num_sims=NUM_SIMULATIONS if ADAPTIVE_BATCH is None else MAX_SIMULATIONS,
+                                variance_reduction=VARIANCE_REDUCTION, adaptive_batch=ADAPTIVE_BATCH)
+    
+    if STREAMING:
+        # Results are written chunk by chunk; only the summary is kept in memory
+        summary = run_streaming(output_dir, CHUNK_SIZE, sim_cache)
+        print(format_cache_stats(sim_cache.stats()))
+        sim_cache.close()
+        if summary.total == 0:
+            print("\nNo matches with complete serve stats")
+            return
+        _, player_stats = analyze_results(None, summary)
+        player_stats.to_csv(output_dir / 'serve_analysis_by_player.csv', index=False)
+        
+        print(f"\n✓ Results saved to {output_dir}/")
+        print("  - serve_analysis_all_matches.csv")
+        print("  - serve_analysis_by_player.csv")
+        return
+    
     # Download data
     matches_df = download_data()
     
     # Calculate serve advantage
-    results_df = calculate_serve_advantage(matches_df)
+    results_df = calculate_serve_advantage(matches_df, sim_cache)
+    print(format_cache_stats(sim_cache.stats()))
+    sim_cache.close()
     
     if results_df is not None:
         # Analyze results
         results_df, player_stats = analyze_results(results_df)
         
         # Save results
-        output_dir = Path('./tennis_analysis_results')
-        output_dir.mkdir(parents=True, exist_ok=True)
-        
         results_df.to_csv(output_dir / 'serve_analysis_all_matches.csv', index=False)
         player_stats.to_csv(output_dir / 'serve_analysis_by_player.csv', index=False)
         
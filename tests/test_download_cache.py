@@ -0,0 +1,112 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from download_cache import DownloadError, concat_match_frames, fetch, read_csv_cached, read_match_csv
+
+BODY = b"tourney_id,match_num\n2024-001,1\n"
+ETAG = '"v1"'
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    status = 200  # Set by the tests; 503 makes every request fail
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get('If-None-Match'))
+        if self.status != 200:
+            self.send_response(self.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.status = 200
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/atp_matches_2024.csv"
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_download_then_not_modified(server, tmp_path):
+    path, status = fetch(server, tmp_path)
+    assert status == 'downloaded'
+    assert path.read_bytes() == BODY
+
+    path, status = fetch(server, tmp_path)
+    assert status == 'not modified'
+    assert path.read_bytes() == BODY
+    assert Handler.requests == [None, ETAG]
+
+def test_server_error_serves_stale_copy(server, tmp_path):
+    fetch(server, tmp_path)
+    Handler.status = 503
+    path, status = fetch(server, tmp_path, retries=2, backoff=0)
+    assert status == 'stale'
+    assert path.read_bytes() == BODY
+    assert len(Handler.requests) == 4  # First download, then the initial try and two retries
+
+def test_server_error_without_copy_raises(server, tmp_path):
+    Handler.status = 503
+    with pytest.raises(DownloadError):
+        fetch(server, tmp_path, retries=1, backoff=0)
+
+def test_not_found_is_not_retried(server, tmp_path):
+    Handler.status = 404
+    with pytest.raises(DownloadError):
+        fetch(server, tmp_path, retries=3, backoff=0)
+    assert len(Handler.requests) == 1
+
+def test_offline(server, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        fetch(server, tmp_path, offline=True)
+    fetch(server, tmp_path)
+    path, status = fetch(server, tmp_path, offline=True)
+    assert status == 'offline'
+    assert path.read_bytes() == BODY
+    assert len(Handler.requests) == 1
+
+def test_parsed_cache_keeps_same_named_files_apart(tmp_path):
+    cache_dir = tmp_path / 'parsed'
+    paths = []
+    for directory, rows in (('a', 1), ('b', 2)):
+        path = tmp_path / directory / 'atp_matches_2024.csv'
+        path.parent.mkdir()
+        path.write_text('match_num\n' + ''.join(f"{i}\n" for i in range(rows)))
+        paths.append(path)
+
+    for path in paths:
+        read_csv_cached(path, cache_dir)
+    assert len(list(cache_dir.iterdir())) == 2
+    assert [len(read_csv_cached(path, cache_dir)) for path in paths] == [1, 2]
+    assert len(list(cache_dir.iterdir())) == 2
+
+def test_concatenated_years_stay_categorical(tmp_path):
+    frames = []
+    for year, (winner, loser) in ((2023, ('Holger Rune', 'Grigor Dimitrov')), (2024, ('Jannik Sinner', 'Holger Rune'))):
+        path = tmp_path / f"atp_matches_{year}.csv"
+        path.write_text(f"tourney_name,winner_name,loser_name,w_svpt\nOpen {year},{winner},{loser},80\n")
+        frames.append(read_match_csv(path, tmp_path / 'parsed'))
+
+    df = concat_match_frames(frames)
+    for name in ('tourney_name', 'winner_name', 'loser_name'):
+        assert isinstance(df[name].dtype, pd.CategoricalDtype)
+    assert df['winner_name'].tolist() == ['Holger Rune', 'Jannik Sinner']
+    assert df['loser_name'].tolist() == ['Grigor Dimitrov', 'Holger Rune']
+    assert df.attrs['source_columns'] == 4
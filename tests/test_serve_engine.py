@@ -0,0 +1,202 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from serve_engine import (CONFIDENCE_Z, FLIP_THRESHOLD, SET_SCORE_LABELS, SimulationCache, difference_se,
+                          hold_probability, markov_match_probability, min_points_to_win, resolve_best_of,
+                          simulate_adaptive, simulate_batch, simulate_counts, tiebreak_probability, win_threshold)
+
+COUNTS = ([60, 55], [45, 38], [20, 21], [80, 80], [3, 3])
+
+def simulate(cache):
+    return simulate_counts(*COUNTS, num_sims=200, cache=cache)
+
+def test_cache_reused_across_opens(tmp_path):
+    path = tmp_path / 'simulations.sqlite'
+    cache = SimulationCache(path, num_sims=200)
+    first = simulate(cache)
+    cache.close()
+
+    cache = SimulationCache(path, num_sims=200)
+    np.testing.assert_array_equal(simulate(cache), first)
+    assert cache.stats()['disk_hits'] == 2
+    cache.close()
+
+def test_cache_cleared_when_settings_change(tmp_path):
+    path = tmp_path / 'simulations.sqlite'
+    cache = SimulationCache(path, num_sims=200)
+    simulate(cache)
+    cache.close()
+
+    cache = SimulationCache(path, num_sims=400)
+    assert cache.get_many(['60|45|20|80|3']) == {}
+    cache.close()
+
+def test_later_open_keeps_rows_written_under_the_same_settings(tmp_path):
+    path = tmp_path / 'simulations.sqlite'
+    SimulationCache(path, num_sims=100).close()
+
+    first = SimulationCache(path, num_sims=200)
+    simulate(first)
+    second = SimulationCache(path, num_sims=200)
+    assert len(second.get_many(['60|45|20|80|3', '55|38|21|80|3'])) == 2
+    first.close()
+    second.close()
+
+def test_hold_probability_closed_form():
+    assert hold_probability(0.5) == pytest.approx(0.5)
+    # 0.6^4 (1 + 4(0.4) + 10(0.4)^2) + 20 (0.6 * 0.4)^3 * 0.36 / 0.52
+    assert hold_probability(0.6) == pytest.approx(0.73573, abs=1e-5)
+    np.testing.assert_allclose(hold_probability([0.0, 1.0]), [0.0, 1.0])
+
+def test_evenly_matched_players_are_even():
+    p = np.array([0.35, 0.5, 0.62, 0.71])
+    np.testing.assert_allclose(tiebreak_probability(p, p), 0.5, atol=1e-12)
+    for best_of in (3, 5):
+        np.testing.assert_allclose(markov_match_probability(p, p, best_of), 0.5, atol=1e-9)
+
+def test_markov_agrees_with_simulated_matches():
+    first_in, first_win, second_win = [0.62, 0.55, 0.68], [0.74, 0.70, 0.79], [0.52, 0.48, 0.55]
+    opponent_p = [0.63, 0.58, 0.66]
+    args = (first_in, first_win, second_win, [80, 70, 120], [3, 3, 5])
+    expected = simulate_batch(*args, engine='markov', opponent_p=opponent_p)
+    simulated = simulate_batch(*args, num_sims=20_000, engine='match', opponent_p=opponent_p,
+                               keys=['a|1|1|w', 'a|1|2|w', 'a|1|3|w'])
+    for exact, sampled in zip(expected, simulated):
+        se = np.sqrt(exact * (1 - exact) / 20_000)
+        assert np.all(np.abs(sampled - exact) < 4 * se)
+
+def binomial_tail_reference(n, p, k_min):
+    return sum(math.comb(n, k) * p**k * (1 - p)**(n - k) for k in range(k_min, n + 1))
+
+@pytest.mark.parametrize('best_of, threshold', [(3, 0.58), (5, 0.56)])
+def test_min_points_to_win_matches_the_simulated_comparison(best_of, threshold):
+    assert win_threshold(best_of) == threshold
+    n = np.arange(1, 301)
+    expected = [next(k for k in range(m + 1) if k / m > threshold) for m in n]
+    np.testing.assert_array_equal(min_points_to_win(n, threshold), expected)
+
+@pytest.mark.parametrize('best_of, k_min', [(3, 30), (5, 29)])
+def test_exact_thresholds(best_of, k_min):
+    # 50 service points: more than 58% is 30 points, more than 56% is 29
+    trad, only_first = simulate_batch([0.6], [0.75], [0.5], [50], [best_of], engine='exact')
+    assert trad[0] == pytest.approx(binomial_tail_reference(50, 0.6 * 0.75 + 0.4 * 0.5, k_min))
+    assert only_first[0] == pytest.approx(binomial_tail_reference(50, 0.6 * 0.75 + 0.4 * 0.6 * 0.75, k_min))
+
+def test_exact_edge_service_points():
+    trad, only_first = simulate_batch([0.6, 0.6], [0.75, 0.75], [0.5, 0.5], [0, 1], [3, 5], engine='exact')
+    # No points: no win; one point: won if that point is
+    np.testing.assert_allclose(trad, [0.0, 0.65])
+    np.testing.assert_allclose(only_first, [0.0, 0.63])
+
+def test_exact_is_the_expectation_of_vectorized():
+    args = ([0.62, 0.55, 0.7], [0.74, 0.68, 0.8], [0.52, 0.5, 0.45], [60, 45, 140], [3, 3, 5])
+    exact = simulate_batch(*args, engine='exact')
+    sampled = simulate_batch(*args, num_sims=20_000, engine='vectorized', keys=['a|1|1|w', 'a|1|2|w', 'a|1|3|w'])
+    for expected, simulated in zip(exact, sampled):
+        se = np.sqrt(expected * (1 - expected) / 20_000)
+        assert np.all(np.abs(simulated - expected) < 4 * se)
+
+# Rows for simulate_adaptive: always won, always lost, a clear-cut gain from first serves only, and one whose
+# expected difference (about -0.148, see engine='exact') sits on -FLIP_THRESHOLD
+ADAPTIVE_ROWS = ([1.0, 0.6, 0.5, 0.595], [1.0, 0.0, 0.8, 0.72], [0.5, 0.0, 0.3, 0.5], [60, 60, 80, 60], [3, 3, 3, 3])
+ADAPTIVE_KEYS = ['a|1|1|w', 'a|1|2|w', 'a|1|3|w', 'a|1|4|w']
+
+def adaptive(**kwargs):
+    return simulate_adaptive(*ADAPTIVE_ROWS, batch_sims=200, max_sims=2000, keys=ADAPTIVE_KEYS, **kwargs)
+
+def test_adaptive_stops_zero_variance_rows_after_one_batch():
+    trad, only_first, diff_se, num_sims = adaptive()
+    np.testing.assert_array_equal(num_sims[:2], [200, 200])
+    np.testing.assert_array_equal(trad[:2], [1.0, 0.0])
+    np.testing.assert_array_equal(diff_se[:2], [0.0, 0.0])
+
+def test_adaptive_stopped_rows_are_clear_of_the_threshold():
+    trad, only_first, diff_se, num_sims = adaptive()
+    stopped = num_sims < 2000
+    distance = np.abs(np.abs(only_first - trad) - FLIP_THRESHOLD)
+    assert stopped[:3].all()
+    assert np.all(CONFIDENCE_Z * diff_se[stopped] <= distance[stopped])
+
+def test_adaptive_reports_rows_at_the_cap():
+    trad, only_first, diff_se, num_sims = adaptive()
+    assert num_sims[3] == 2000
+    diff = only_first[3] - trad[3]
+    assert diff - CONFIDENCE_Z * diff_se[3] < -FLIP_THRESHOLD < diff + CONFIDENCE_Z * diff_se[3]
+
+@pytest.mark.parametrize('seeded', ['keys', 'rng'])
+def test_adaptive_is_reproducible(seeded):
+    def run():
+        if seeded == 'keys':
+            return adaptive()
+        return simulate_adaptive(*ADAPTIVE_ROWS, batch_sims=200, max_sims=2000, rng=np.random.default_rng(7))
+    for first, second in zip(run(), run()):
+        np.testing.assert_array_equal(first, second)
+
+def test_difference_se_pairs_antithetic_draws():
+    trad_won = np.zeros((1, 4), dtype=bool)
+    only_first_won = np.array([[True, False, False, True]])
+    # Four independent samples [1, 0, 0, 1], or two pairs (sim j with j + 2) averaging 0.5 each
+    assert difference_se(trad_won, only_first_won)[0] == pytest.approx(np.std([1, 0, 0, 1], ddof=1) / 2)
+    assert difference_se(trad_won, only_first_won, antithetic=True)[0] == 0.0
+
+def test_common_random_numbers_shrink_the_difference_se():
+    args = ([0.62, 0.55, 0.7], [0.74, 0.68, 0.8], [0.52, 0.5, 0.45], [60, 45, 140], [3, 3, 5])
+    keys = ['a|1|1|w', 'a|1|2|w', 'a|1|3|w']
+    se = {mode: simulate_batch(*args, num_sims=2000, engine='match', keys=keys, opponent_p=[0.6, 0.55, 0.68],
+                               variance_reduction=mode, return_se=True)[2]
+          for mode in ('independent', 'crn', 'antithetic')}
+    assert np.all(se['crn'] < se['independent'])
+    assert np.all(se['antithetic'] < se['independent'])
+
+@pytest.mark.parametrize('adaptive_batch', [None, 100])
+@pytest.mark.parametrize('cached', [False, True])
+def test_winning_set_scores_add_up_to_the_win_probability(tmp_path, cached, adaptive_batch):
+    cache = SimulationCache(tmp_path / 'simulations.sqlite', engine='match', num_sims=400) if cached else None
+    trad, only_first, set_scores = simulate_counts(
+        [40, 38, 60, 40], [30, 25, 45, 30], [12, 11, 16, 12], [60, 58, 95, 60], [3, 3, 5, 3], num_sims=400,
+        engine='match', cache=cache, opp_points_won=[36, 35, 55, 36], opp_svpt=[58, 60, 90, 58],
+        adaptive_batch=adaptive_batch, return_set_scores=True)
+    winning = [i for i, label in enumerate(SET_SCORE_LABELS) if label[0] > label[-1]]
+    np.testing.assert_allclose(set_scores[:, 0, winning].sum(axis=1), trad, atol=1e-12)
+    np.testing.assert_allclose(set_scores[:, 1, winning].sum(axis=1), only_first, atol=1e-12)
+    np.testing.assert_allclose(set_scores.sum(axis=2), 1.0)
+
+@pytest.mark.parametrize('engine', ['vectorized', 'match'])
+def test_same_results_with_and_without_the_cache(tmp_path, engine):
+    counts = ([40, 38, 40], [30, 25, 30], [12, 11, 12], [60, 58, 60], [3, 3, 3])
+    opponent = {'opp_points_won': [36, 35, 36], 'opp_svpt': [58, 60, 58]}
+    uncached = simulate_counts(*counts, num_sims=200, engine=engine, return_se=True, **opponent)
+    cache = SimulationCache(tmp_path / 'simulations.sqlite', engine=engine, num_sims=200)
+    cached = simulate_counts(*counts, num_sims=200, engine=engine, cache=cache, return_se=True, **opponent)
+    for first, second in zip(uncached, cached):
+        np.testing.assert_array_equal(first, second)
+    # Rows 0 and 2 have the same counts, so the same simulated values
+    assert uncached[0][0] == uncached[0][2]
+    cache.close()
+
+def test_native_best_of_wins():
+    df = pd.DataFrame({'best_of': [5, 3, np.nan], 'tourney_level': ['A', 'G', 'G'], 'tour': 'ATP',
+                       'tourney_name': ['Davis Cup', 'Wimbledon', 'Wimbledon']})
+    best_of, unresolved = resolve_best_of(df)
+    np.testing.assert_array_equal(best_of, [5, 3, 5])
+    assert unresolved == []
+
+def test_slam_level_is_best_of_5_for_atp_only():
+    # The level decides even when the name says otherwise
+    df = pd.DataFrame({'tourney_level': ['G', 'G', 'M', 'A'], 'tour': ['ATP', 'WTA', 'ATP', 'ATP'],
+                       'tourney_name': ['Roland Garros', 'Roland Garros', 'Indian Wells', 'Wimbledon']})
+    best_of, unresolved = resolve_best_of(df)
+    np.testing.assert_array_equal(best_of, [5, 3, 3, 3])
+    assert unresolved == []
+
+def test_name_fallback_and_unresolved():
+    df = pd.DataFrame({'tourney_name': ['Australian Open', 'The Championships', 'Miami Masters', 'Miami Masters',
+                                        'Wimbledon', '']})
+    best_of, unresolved = resolve_best_of(df)
+    # No tour column: treated as ATP
+    np.testing.assert_array_equal(best_of, [5, 3, 3, 3, 5, 3])
+    assert unresolved == ['Miami Masters', 'The Championships']
+    assert resolve_best_of(df.assign(tour='WTA'))[0].tolist() == [3, 3, 3, 3, 3, 3]
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import site_data
+from site_data import decode_columnar, embed_data, encode_columnar, write_artifact, write_manifest
+
+RECORDS = [
+    {'tour': 'ATP', 'p': 'Grigor Dimitrov', 'o': 'Holger Rune', 'w': 1, 't': 'Brisbane', 'd': '20240101',
+     'b': '3', 's': 'Hard', 'sc': '7-6(5) 6-4', 'fi': 70.27, 'fw': 76.92, 'sw': 59.09, 'bp': -1.5, 'ob': 0,
+     'cf': 0, 'sd': -0.6, 'ns': 1000},
+    {'tour': 'WTA', 'p': 'Holger Rune', 'o': 'Grigor Dimitrov', 'w': 0, 't': 'Wimbledon', 'd': '20240701',
+     'b': '5', 's': 'Grass', 'sc': '6-4 3-6 7-5', 'fi': 61.05, 'fw': 80.0, 'sw': 33.33, 'bp': 2.31, 'ob': 1,
+     'cf': 1, 'sd': 17.25, 'ns': 4200},
+]
+
+def test_columnar_round_trip():
+    encoded = json.loads(json.dumps(encode_columnar(RECORDS)))
+    assert encoded['length'] == len(RECORDS)
+    assert encoded['strings']['players'] == ['Grigor Dimitrov', 'Holger Rune']
+    assert decode_columnar(encoded) == RECORDS
+
+def test_version_1_data_has_no_simulation_counts():
+    encoded = encode_columnar(RECORDS)
+    del encoded['columns']['ns']
+    assert decode_columnar(encoded) == [{k: v for k, v in record.items() if k != 'ns'} for record in RECORDS]
+
+def test_records_pass_through():
+    assert decode_columnar(RECORDS) is RECORDS
+
+def test_manifest_only_removes_files_it_listed(tmp_path):
+    old = write_artifact(tmp_path, 'data.json', {'v': 1})
+    write_manifest(tmp_path, {'data.json': old})
+    unrelated = tmp_path / 'vendor.0123456789ab.js'
+    unrelated.write_text('')
+
+    new = write_artifact(tmp_path, 'data.json', {'v': 2})
+    write_manifest(tmp_path, {'data.json': new})
+    assert not (tmp_path / old['path']).exists()
+    assert not (tmp_path / f"{old['path']}.gz").exists()
+    assert (tmp_path / new['path']).exists()
+    assert unrelated.exists()
+
+TEMPLATE = """<html>
+<script>
+    // BEGIN MATCH_DATA
+    const MATCH_DATA = [{"p": "old"}];
+    // END MATCH_DATA
+    const decoded = MATCH_DATA.map(x => x);  // ]; after the block stays too
+</script>
+</html>
+"""
+
+TRICKY = [{'p': 'A ]; B', 't': '// END MATCH_DATA', 'sc': '\n// END MATCH_DATA\n];'}]
+
+def splice(tmp_path, template=TEMPLATE, data=TRICKY):
+    template_path = tmp_path / 'template.html'
+    template_path.write_text(template, encoding='utf-8')
+    output_path = tmp_path / 'page.html'
+    embed_data(template_path, output_path, {'MATCH_DATA': data})
+    return output_path.read_text(encoding='utf-8')
+
+def test_embed_data_survives_markers_and_brackets_in_the_data(tmp_path):
+    page = splice(tmp_path)
+    lines = page.splitlines(keepends=True)
+    template_lines = TEMPLATE.splitlines(keepends=True)
+    assert lines[:3] == template_lines[:3]
+    assert lines[3].startswith('    const MATCH_DATA = ') and lines[3].endswith(';\n')
+    assert json.loads(lines[3][len('    const MATCH_DATA = '):-2]) == TRICKY
+    assert lines[4:] == template_lines[4:]
+
+    # The built page is a valid template for the next splice
+    assert splice(tmp_path, template=page, data=[{'p': 'new'}]) == splice(tmp_path, data=[{'p': 'new'}])
+
+def test_embed_data_reads_long_lines_in_pieces(tmp_path, monkeypatch):
+    data = [{'p': 'x' * 5000}]
+    expected = splice(tmp_path, template=TEMPLATE.replace('"old"', '"' + 'y' * 5000 + '"'), data=data)
+    # Longer than the marker lines, far shorter than the data lines
+    monkeypatch.setattr(site_data, '_READ_SIZE', 64)
+    assert splice(tmp_path, template=TEMPLATE.replace('"old"', '"' + 'y' * 5000 + '"'), data=data) == expected
+    assert splice(tmp_path, template=expected, data=data) == expected
+
+@pytest.mark.parametrize('template', [TEMPLATE.replace('// BEGIN MATCH_DATA', ''),
+                                      TEMPLATE.replace('// END MATCH_DATA', '')])
+def test_embed_data_needs_a_complete_block(tmp_path, template):
+    (tmp_path / 'page.html').write_text('previous build')
+    with pytest.raises(ValueError):
+        splice(tmp_path, template=template)
+    assert (tmp_path / 'page.html').read_text() == 'previous build'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['page.html', 'template.html']
@@ -0,0 +1,62 @@
+import gzip
+import re
+import sys
+
+import pytest
+
+import update_data
+from benchmark import benchmark_data
+from profiling import StageTimer
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """run() on synthetic matches, with state in tmp_path and a deploy command that logs each call"""
+    matches = benchmark_data(400)
+    monkeypatch.setattr(update_data, 'download_all_tours', lambda *args, **kwargs: {'ATP': matches.copy(), 'WTA': None})
+    monkeypatch.setattr(update_data, 'RESULT_STORE', tmp_path / 'results.json')
+    monkeypatch.setattr(update_data, 'DEPLOY_STATE', tmp_path / 'last_deploy.json')
+    deploy_log = tmp_path / 'deploys.log'
+    deploy_cmd = f"{sys.executable} -c \"open({str(deploy_log)!r}, 'a').write('deployed\\n')\""
+
+    def run(*options):
+        monkeypatch.setattr(sys, 'argv', ['update_data.py', '--site-dir', str(tmp_path / 'site'),
+                                          '--deploy-cmd', deploy_cmd, '--no-sim-cache', *options])
+        update_data.run(update_data.parse_args(), StageTimer())
+        return deploy_log.read_text().count('deployed') if deploy_log.exists() else 0
+
+    return run
+
+def test_unchanged_build_skips_deploy(pipeline, capsys):
+    assert pipeline() == 1
+    assert pipeline() == 1
+    assert "Nothing changed since the last deploy" in capsys.readouterr().out
+
+def test_dry_run_leaves_state_alone(pipeline, tmp_path):
+    assert pipeline('--dry-run') == 0
+    assert not (tmp_path / 'results.json').exists()
+    assert not (tmp_path / 'last_deploy.json').exists()
+    assert not (tmp_path / 'site').exists()
+
+def test_artifact_count_includes_removed_files(pipeline, capsys):
+    pipeline()
+    capsys.readouterr()
+    pipeline('--dry-run', '--no-shards')
+    changed, total = map(int, re.search(r"Artifacts: (\d+) of (\d+) changed", capsys.readouterr().out).groups())
+    assert 0 < changed <= total
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_worker_count_does_not_change_results(tmp_path, cached):
+    matches = benchmark_data(300)
+    matches['tour'] = 'ATP'
+    runs = []
+    for jobs in (1, 3):
+        sim_cache_path = tmp_path / f"simulations-{jobs}.sqlite" if cached else None
+        records, _ = update_data.calculate_serve_advantage_parallel(matches, jobs, sim_cache_path=sim_cache_path)
+        runs.append(records)
+    assert len(runs[0]) > 0
+    assert runs[0] == runs[1]
+
+def test_stable_data_json_is_precompressed(pipeline, tmp_path):
+    pipeline()
+    site = tmp_path / 'site'
+    assert gzip.decompress((site / 'data.json.gz').read_bytes()) == (site / 'data.json').read_bytes()
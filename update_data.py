@@ -7,204 +7,443 @@ Pulls latest ATP + WTA data, runs analysis, rebuilds site
 import pandas as pd
 import numpy as np
 from pathlib import Path
+import argparse
+import cProfile
+import hashlib
 import json
+import os
+import shlex
 import subprocess
 import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from download_cache import concat_match_frames, fetch_all, format_memory_saving, read_match_csv
+from profiling import StackSampler, StageTimer
+from serve_engine import (BASE_SEED, CONFIDENCE_Z, ENGINE_VERSION, FLIP_THRESHOLD, OPPONENT_ENGINES,
+                          SimulationCache, column_or, format_cache_stats, performance_frame, performance_keys,
+                          resolve_best_of, simulate_counts)
+from site_data import (SHARD_COUNT, SHARD_PATH, embed_data, encode_columnar, player_summary, precompress_file,
+                       shard_records, write_artifact, write_json_atomic, write_manifest)
 
 # Configuration
 YEARS = range(2024, 2026)
 NUM_SIMULATIONS = 1000
-np.random.seed(42)
-
-ATP_URL = "https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_{}.csv"
-WTA_URL = "https://raw.githubusercontent.com/JeffSackmann/tennis_wta/master/wta_matches_{}.csv"
-
-def download_tour_data(tour='ATP'):
-    """Download match data from GitHub"""
-    print(f"\nLoading {tour} data...")
-    url_template = ATP_URL if tour == 'ATP' else WTA_URL
-    dfs = []
-
-    for year in YEARS:
-        try:
-            url = url_template.format(year)
-            df = pd.read_csv(url)
+SIM_ENGINE = 'vectorized'  # 'vectorized' / 'match' (sampled) or 'exact' / 'markov' (no sampling)
+VARIANCE_REDUCTION = 'independent'  # Or 'crn' / 'antithetic' ('match' only): shared (mirrored) draws for both strategies
+ADAPTIVE_BATCH = None  # e.g. 200: simulate in batches until each row is clearly above or below FLIP_THRESHOLD
+MAX_SIMULATIONS = 10_000  # Per-row cap in adaptive mode (NUM_SIMULATIONS is then unused)
+
+# Results from previous runs, keyed by match fingerprint (see calculate_serve_advantage)
+CACHE_DIR = Path(__file__).resolve().parent / '.cache'
+RESULT_STORE = CACHE_DIR / 'results.json'
+SIM_CACHE = CACHE_DIR / 'simulations.sqlite'  # Simulated probabilities keyed by serve counts
+DEPLOY_STATE = CACHE_DIR / 'last_deploy.json'  # Manifest and record digests of the last successful deploy
+PROFILE_DIR = CACHE_DIR / 'profiles'  # --profile reports
+
+# Run from the site directory to publish it; replace (--deploy-cmd / TENNIS_DEPLOY_CMD) to
+# deploy elsewhere or with a local stand-in
+DEPLOY_COMMAND = os.environ.get('TENNIS_DEPLOY_CMD', 'npx vercel --prod --yes')
+
+# Serve counts every analyzed match needs
+SERVE_COLUMNS = ['w_1stIn', 'w_1stWon', 'w_2ndWon', 'w_svpt',
+                 'l_1stIn', 'l_1stWon', 'l_2ndWon', 'l_svpt']
+
+# Scores marking matches that weren't played out; these aren't published
+UNFINISHED_MARKERS = ('RET', 'W/O', 'DEF')
+
+# The page template (with the MATCH_DATA markers) lives next to this script; the built
+# page and data.json go to SITE_DIR (override with --site-dir or TENNIS_SITE_DIR)
+TEMPLATE_HTML = Path(__file__).resolve().parent / 'tennis_player_view-embedded.html'
+SITE_DIR = Path(os.environ.get('TENNIS_SITE_DIR', Path(__file__).resolve().parent))
+
+# Point at a local mirror (e.g. a test server with fixture CSVs) with TENNIS_DATA_URL
+DATA_URL = os.environ.get('TENNIS_DATA_URL', "https://raw.githubusercontent.com/JeffSackmann")
+ATP_URL = DATA_URL + "/tennis_atp/master/atp_matches_{}.csv"
+WTA_URL = DATA_URL + "/tennis_wta/master/wta_matches_{}.csv"
+
+def download_all_tours(tours=('ATP', 'WTA'), offline=False, timer=None):
+    """
+    Download match data for every tour and year from GitHub concurrently
+
+    Unchanged years are served from the download cache. Returns {tour: DataFrame or None}.
+    Files are parsed in the download threads as they arrive; timer gets a
+    'download' stage for the whole fetch and a 'parse' stage summed over files.
+    """
+    timer = timer or StageTimer()
+    print(f"\nLoading {' + '.join(tours)} data...")
+    urls = {}
+    for tour in tours:
+        url_template = ATP_URL if tour == 'ATP' else WTA_URL
+        for year in YEARS:
+            urls[url_template.format(year)] = (tour, year)
+
+    frames = {}
+    parse_times = []  # (wall, thread CPU) per file; list.append is thread-safe
+    def parse(path):
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        df = read_match_csv(path, CACHE_DIR / 'parsed')
+        parse_times.append((time.perf_counter() - wall_start, time.thread_time() - cpu_start))
+        return df
+
+    with timer.stage('download') as stage:
+        for url, status, df, error in fetch_all(urls, parse=parse, cache_dir=CACHE_DIR / 'downloads',
+                                                offline=offline):
+            tour, year = urls[url]
+            if error is not None:
+                print(f"  {tour} {year}: {error}")
+                continue
             df['tour'] = tour
-            dfs.append(df)
-            print(f"  {year}: {len(df)} matches")
-        except Exception as e:
-            print(f"  {year}: {e}")
-
-    if dfs:
-        return pd.concat(dfs, ignore_index=True)
-    return None
-
-def simulate_match_outcome(first_in_pct, first_win_pct, second_win_pct, service_points, best_of=3):
-    """Monte Carlo simulation for win probability"""
-    traditional_wins = 0
-    only_first_wins = 0
-
-    for _ in range(NUM_SIMULATIONS):
-        # Traditional strategy
-        trad_points_won = 0
-        for _ in range(service_points):
-            if np.random.random() < first_in_pct:
-                if np.random.random() < first_win_pct:
-                    trad_points_won += 1
-            else:
-                if np.random.random() < second_win_pct:
-                    trad_points_won += 1
-
-        # Only first serves strategy
-        only_first_points_won = 0
-        for _ in range(service_points):
-            if np.random.random() < first_in_pct:
-                if np.random.random() < first_win_pct:
-                    only_first_points_won += 1
-            else:
-                if np.random.random() < first_in_pct:
-                    if np.random.random() < first_win_pct:
-                        only_first_points_won += 1
-
-        win_threshold = 0.58 if best_of == 3 else 0.56
-
-        if service_points > 0:
-            if trad_points_won / service_points > win_threshold:
-                traditional_wins += 1
-            if only_first_points_won / service_points > win_threshold:
-                only_first_wins += 1
-
+            frames[tour, year] = df
+            print(f"  {tour} {year}: {len(df)} matches ({status})")
+        stage.rows_out = sum(len(df) for df in frames.values())
+        stage.notes = 'includes parsing'
+
+    # Files finish in any order; assemble each tour in year order
+    with timer.stage('parse') as stage:
+        result = {}
+        for tour in tours:
+            dfs = [frames[tour, year] for year in YEARS if (tour, year) in frames]
+            result[tour] = concat_match_frames(dfs) if dfs else None
+    timer.record('parse', sum(wall for wall, _ in parse_times), sum(cpu for _, cpu in parse_times),
+                 rows_out=sum(len(df) for df in frames.values()),
+                 notes=f"{len(parse_times)} files, summed over download threads")
+    return result
+
+def simulation_count():
+    """Simulations per row, or the per-row maximum in adaptive mode"""
+    return NUM_SIMULATIONS if ADAPTIVE_BATCH is None else MAX_SIMULATIONS
+
+def store_config():
+    """Settings that change simulated values; a stored result is only reused if these match"""
+    config = {'engine': SIM_ENGINE, 'engine_version': ENGINE_VERSION, 'num_simulations': simulation_count(),
+              'variance_reduction': VARIANCE_REDUCTION, 'base_seed': BASE_SEED}
+    if ADAPTIVE_BATCH is not None:
+        config.update(adaptive_batch=ADAPTIVE_BATCH, flip_threshold=FLIP_THRESHOLD, confidence_z=CONFIDENCE_Z)
+    return config
+
+def load_result_store(path=RESULT_STORE):
+    """Load stored results ({fingerprint: {'h': input digest, 'r': record}}), empty if stale or missing"""
+    if not path.exists():
+        return {}
+    try:
+        saved = json.loads(path.read_text())
+    except (OSError, ValueError) as e:
+        print(f"  Ignoring unreadable result store: {e}")
+        return {}
+    if saved.get('config') != store_config():
+        print("  Simulation settings changed, discarding stored results")
+        return {}
+    return saved.get('records', {})
+
+def save_result_store(store, path=RESULT_STORE):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({'config': store_config(), 'records': store}, separators=(',', ':')))
+    tmp_path.replace(path)
+
+def completed(record):
+    """Whether a record's match was played out (no retirement, walkover or default)"""
+    return not any(marker in (record.get('sc') or '') for marker in UNFINISHED_MARKERS)
+
+def record_digests(store):
+    """{fingerprint: digest of the record} for the completed matches in a result store"""
     return {
-        'traditional_prob': traditional_wins / NUM_SIMULATIONS,
-        'only_first_prob': only_first_wins / NUM_SIMULATIONS,
+        key: hashlib.sha256(json.dumps(entry['r'], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        for key, entry in store.items() if completed(entry['r'])
     }
 
-def calculate_serve_advantage(df):
-    """Calculate serve statistics for all matches"""
-    print("\nCalculating serve statistics...")
-
-    required_cols = ['w_1stIn', 'w_1stWon', 'w_2ndWon', 'w_svpt',
-                     'l_1stIn', 'l_1stWon', 'l_2ndWon', 'l_svpt']
-
-    missing = [col for col in required_cols if col not in df.columns]
+def load_deploy_state(path=DEPLOY_STATE):
+    """What was last deployed: {'site_dir', 'files' (manifest files), 'records' (record_digests)}, or {}"""
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"  Ignoring unreadable deploy state: {e}")
+        return {}
+
+def save_deploy_state(state, path=DEPLOY_STATE):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(state, separators=(',', ':')))
+    tmp_path.replace(path)
+
+def deploy_diff(last, files, digests):
+    """
+    Compare a build with the last deploy state.
+
+    Returns (added, changed, removed) record counts and the logical names of
+    artifacts whose content changed (or were added or removed).
+    """
+    last_digests = last.get('records', {})
+    added = sum(1 for key in digests if key not in last_digests)
+    removed = sum(1 for key in last_digests if key not in digests)
+    changed = sum(1 for key, digest in digests.items() if key in last_digests and last_digests[key] != digest)
+
+    last_files = last.get('files', {})
+    changed_files = sorted(
+        name for name in set(files) | set(last_files)
+        if files.get(name, {}).get('sha256') != last_files.get(name, {}).get('sha256')
+    )
+    return (added, changed, removed), changed_files
+
+def print_deploy_diff(record_counts, changed_files, files, last_files):
+    added, changed, removed = record_counts
+    print(f"  Records: {added:,} added, {changed:,} changed, {removed:,} removed since the last deploy")
+    # Removed artifacts count as changed, so count them in the total too
+    print(f"  Artifacts: {len(changed_files)} of {len(set(files) | set(last_files))} changed")
+    for name in changed_files[:10]:
+        print(f"    {name}")
+    if len(changed_files) > 10:
+        print(f"    ... and {len(changed_files) - 10} more")
+
+def has_serve_columns(df):
+    """Whether df has every SERVE_COLUMNS column (the missing ones are printed if not)"""
+    missing = [col for col in SERVE_COLUMNS if col not in df.columns]
     if missing:
         print(f"Missing columns: {missing}")
-        return None
-
-    df_clean = df.dropna(subset=required_cols).copy()
-    print(f"Matches with complete serve stats: {len(df_clean):,}")
+    return not missing
+
+def store_for_shard(store, shard):
+    """The store entries for the matches in shard (both sides of each)"""
+    prefixes = (column_or(shard, 'tour', 'ATP').astype(str) + '|'
+                + column_or(shard, 'tourney_id', shard.index).astype(str) + '|'
+                + column_or(shard, 'match_num', shard.index).astype(str))
+    return {key: store[key] for prefix in prefixes for key in (f"{prefix}|w", f"{prefix}|l") if key in store}
+
+def build_records(perf, prob_diff, num_sims):
+    """Output records (short keys used by the site) for rows of a performance frame"""
+    records = pd.DataFrame({
+        'tour': perf['tour'],
+        'p': perf['player'],
+        'o': perf['opponent'],
+        'w': perf['won'].astype(int),
+        't': perf['tourney_name'],
+        'd': perf['tourney_date'],
+        'b': perf['best_of'].astype(str),
+        's': perf['surface'],
+        'sc': perf['score'],
+        'fi': np.round(perf['first_in_pct'] * 100, 2),
+        'fw': np.round(perf['first_win_pct'] * 100, 2),
+        'sw': np.round(perf['second_win_pct'] * 100, 2),
+        'bp': np.round((perf['only_first'] - perf['traditional']) * 100, 2),
+        'ob': perf['only_first_better'].astype(int),
+        'cf': (np.abs(prob_diff) > FLIP_THRESHOLD).astype(int),
+        'sd': np.round(prob_diff * 100, 2),
+        'ns': num_sims,  # Simulations behind sd (0 for engines without sampling)
+    })
+    return records.to_dict('records')
+
+def calculate_serve_advantage(df, store=None, sim_cache=None, timer=None):
+    """
+    Calculate serve statistics for all matches
+
+    If store (see load_result_store) is given, performances whose fingerprint
+    (tour, tourney_id, match_num, side) and inputs are unchanged reuse the stored
+    record, only new or changed ones are simulated, and store is updated in place
+    to hold exactly the performances in df. sim_cache (a SimulationCache) reuses
+    simulations across performances with identical serve counts. timer (a
+    StageTimer) gets 'clean', 'compute' and 'simulate' stages.
+    """
+    timer = timer or StageTimer()
+    print("\nCalculating serve statistics...")
 
-    results = []
-    total = len(df_clean)
+    if not has_serve_columns(df):
+        return None
 
-    for i, (idx, row) in enumerate(df_clean.iterrows()):
-        if i % 500 == 0:
-            print(f"  Processing {i}/{total}...")
+    with timer.stage('clean', rows_in=len(df)) as stage:
+        df_clean = df.dropna(subset=SERVE_COLUMNS)
+        print(f"Matches with complete serve stats: {len(df_clean):,}")
 
-        tour = row.get('tour', 'ATP')
-        tourney_name = row.get('tourney_name', '').lower()
+        tour = column_or(df_clean, 'tour', 'ATP')
+        tourney_name = column_or(df_clean, 'tourney_name', 'Unknown')
 
         # Determine best of (Grand Slams are BO5 for ATP men only)
-        is_grand_slam = any(slam in tourney_name for slam in
-                          ['australian open', 'roland garros', 'wimbledon', 'us open'])
-        best_of = 5 if (is_grand_slam and tour == 'ATP') else 3
-
-        # Winner stats
-        if row['w_svpt'] > 0 and row['w_1stIn'] > 0:
-            first_in_pct = row['w_1stIn'] / row['w_svpt']
-            first_win_pct = row['w_1stWon'] / row['w_1stIn']
-            second_serve_points = row['w_svpt'] - row['w_1stIn']
-
-            if second_serve_points > 0:
-                second_win_pct = row['w_2ndWon'] / second_serve_points
-
-                only_first = first_in_pct * first_win_pct + (1 - first_in_pct) * first_in_pct * first_win_pct
-                traditional = first_in_pct * first_win_pct + (1 - first_in_pct) * second_win_pct
-                only_first_better = (first_in_pct * first_win_pct) > second_win_pct
-
-                sim = simulate_match_outcome(first_in_pct, first_win_pct, second_win_pct, int(row['w_svpt']), best_of)
-                prob_diff = sim['only_first_prob'] - sim['traditional_prob']
-
-                results.append({
-                    'tour': tour,
-                    'p': row.get('winner_name', 'Unknown'),
-                    'o': row.get('loser_name', 'Unknown'),
-                    'w': 1,
-                    't': row.get('tourney_name', 'Unknown'),
-                    'd': str(row.get('tourney_date', '')),
-                    'b': str(best_of),
-                    's': row.get('surface', '?'),
-                    'sc': row.get('score', ''),
-                    'fi': round(first_in_pct * 100, 2),
-                    'fw': round(first_win_pct * 100, 2),
-                    'sw': round(second_win_pct * 100, 2),
-                    'bp': round((only_first - traditional) * 100, 2),
-                    'ob': 1 if only_first_better else 0,
-                    'cf': 1 if abs(prob_diff) > 0.15 else 0,
-                    'sd': round(prob_diff * 100, 2),
-                })
-
-        # Loser stats
-        if row['l_svpt'] > 0 and row['l_1stIn'] > 0:
-            first_in_pct = row['l_1stIn'] / row['l_svpt']
-            first_win_pct = row['l_1stWon'] / row['l_1stIn']
-            second_serve_points = row['l_svpt'] - row['l_1stIn']
-
-            if second_serve_points > 0:
-                second_win_pct = row['l_2ndWon'] / second_serve_points
-
-                only_first = first_in_pct * first_win_pct + (1 - first_in_pct) * first_in_pct * first_win_pct
-                traditional = first_in_pct * first_win_pct + (1 - first_in_pct) * second_win_pct
-                only_first_better = (first_in_pct * first_win_pct) > second_win_pct
-
-                sim = simulate_match_outcome(first_in_pct, first_win_pct, second_win_pct, int(row['l_svpt']), best_of)
-                prob_diff = sim['only_first_prob'] - sim['traditional_prob']
-
-                results.append({
-                    'tour': tour,
-                    'p': row.get('loser_name', 'Unknown'),
-                    'o': row.get('winner_name', 'Unknown'),
-                    'w': 0,
-                    't': row.get('tourney_name', 'Unknown'),
-                    'd': str(row.get('tourney_date', '')),
-                    'b': str(best_of),
-                    's': row.get('surface', '?'),
-                    'sc': row.get('score', ''),
-                    'fi': round(first_in_pct * 100, 2),
-                    'fw': round(first_win_pct * 100, 2),
-                    'sw': round(second_win_pct * 100, 2),
-                    'bp': round((only_first - traditional) * 100, 2),
-                    'ob': 1 if only_first_better else 0,
-                    'cf': 1 if abs(prob_diff) > 0.15 else 0,
-                    'sd': round(prob_diff * 100, 2),
-                })
-
-    return results
-
-def update_html(data):
-    """Embed data into HTML file"""
+        best_of, unresolved = resolve_best_of(df_clean)
+        if unresolved:
+            print(f"  No format data for {len(unresolved)} tournaments, assumed best of 3: {', '.join(unresolved)}")
+        stage.rows_out = len(df_clean)
+
+    with timer.stage('compute', rows_in=len(df_clean)) as stage:
+        # One row per player per match, all serve math as whole-column operations
+        perf = performance_frame(
+            df_clean,
+            tour=tour,
+            tourney_id=column_or(df_clean, 'tourney_id', df_clean.index),
+            match_num=column_or(df_clean, 'match_num', df_clean.index),
+            tourney_name=tourney_name,
+            tourney_date=column_or(df_clean, 'tourney_date', '').astype(str),
+            best_of=best_of,
+            surface=column_or(df_clean, 'surface', '?'),
+            score=column_or(df_clean, 'score', ''),
+        )
+        stage.rows_out = len(perf)
+        if perf.empty:
+            if store is not None:
+                store.clear()
+            return []
+
+        keys = performance_keys(perf).tolist()
+        # Digest of everything that feeds a record, so corrected upstream rows are recomputed
+        digest_cols = ['player', 'opponent', 'won', 'svpt', 'first_in', 'first_won', 'second_won',
+                       'tourney_name', 'tourney_date', 'best_of', 'surface', 'score']
+        if SIM_ENGINE in OPPONENT_ENGINES:
+            digest_cols += ['opp_svpt', 'opp_points_won']
+        digests = pd.util.hash_pandas_object(perf[digest_cols].astype(str), index=False).astype(str).tolist()
+
+        if store is None:
+            todo = np.ones(len(perf), dtype=bool)
+        else:
+            todo = np.array([store.get(key, {}).get('h') != digest for key, digest in zip(keys, digests)], dtype=bool)
+            print(f"  Reusing {(~todo).sum():,} stored performances, {todo.sum():,} new or changed")
+
+    # Simulate every new performance in one batched call
+    new_perf = perf[todo]
+    new_records = []
+    if len(new_perf):
+        print(f"  Simulating {len(new_perf):,} performances...")
+        with timer.stage('simulate', rows_in=len(new_perf)) as stage:
+            trad_prob, only_first_prob, num_sims = simulate_counts(
+                new_perf['first_in'], new_perf['first_won'], new_perf['second_won'],
+                new_perf['svpt'], new_perf['best_of'],
+                num_sims=simulation_count(), engine=SIM_ENGINE, cache=sim_cache,
+                opp_points_won=new_perf['opp_points_won'], opp_svpt=new_perf['opp_svpt'],
+                variance_reduction=VARIANCE_REDUCTION, adaptive_batch=ADAPTIVE_BATCH, return_sims=True
+            )
+            stage.rows_out = len(trad_prob)
+            if ADAPTIVE_BATCH is not None:
+                print(f"  Adaptive: {num_sims.mean():,.0f} simulations per performance on average, "
+                      f"{(num_sims >= MAX_SIMULATIONS).sum():,} at the {MAX_SIMULATIONS:,} cap")
+        with timer.stage('compute'):
+            new_records = build_records(new_perf, only_first_prob - trad_prob, num_sims)
+
+    if store is None:
+        return new_records
+
+    # Merge stored and new records back into frame order
+    with timer.stage('compute'):
+        fresh = iter(new_records)
+        records = [next(fresh) if is_new else store[key]['r'] for key, is_new in zip(keys, todo)]
+        store.clear()
+        store.update({key: {'h': digest, 'r': record} for key, digest, record in zip(keys, digests, records)})
+    return records
+
+def _analyze_shard(shard, store, sim_cache_path):
+    """Worker entry point: returns the shard's records, its updated store, cache stats and stage timings"""
+    timer = StageTimer()
+    sim_cache = None
+    if sim_cache_path is not None:
+        sim_cache = SimulationCache(sim_cache_path, engine=SIM_ENGINE, num_sims=simulation_count(),
+                                    variance_reduction=VARIANCE_REDUCTION, adaptive_batch=ADAPTIVE_BATCH)
+    try:
+        records = calculate_serve_advantage(shard, store, sim_cache, timer)
+        return records, store, sim_cache.stats() if sim_cache else None, timer.report()['stages']
+    finally:
+        if sim_cache:
+            sim_cache.close()
+
+def calculate_serve_advantage_parallel(df, jobs, store=None, sim_cache_path=None, timer=None):
+    """
+    Shard matches across a process pool and run calculate_serve_advantage on each shard
+
+    Returns (records, simulation cache stats or None). Worker stage timings are
+    summed into timer.
+    """
+    timer = timer or StageTimer()
+    if jobs <= 1:
+        records, store, cache_stats, stages = _analyze_shard(df, store, sim_cache_path)
+        timer.add(stages)
+        return records, cache_stats
+
+    if not has_serve_columns(df):
+        return None, None
+
+    # Workers drop incomplete matches themselves (the 'clean' stage, summed over workers)
+    with timer.stage('clean'):
+        shards = [df.iloc[bounds[0]:bounds[-1] + 1]
+                  for bounds in np.array_split(np.arange(len(df)), jobs) if len(bounds)]
+        shard_stores = [None if store is None else store_for_shard(store, shard) for shard in shards]
+    print(f"\nRunning {len(shards)} shards on {jobs} workers...")
+
+    # Each performance is seeded by its serve counts (see simulate_counts), so shard results
+    # are identical to a serial run and concatenating in shard order keeps row order
+    # Every worker gets the stored entries for its own matches and returns them updated
+    results = []
+    merged_store = {}
+    cache_stats = None
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        shard_runs = pool.map(_analyze_shard, shards, shard_stores, [sim_cache_path] * len(shards))
+        for shard_results, shard_store, shard_stats, shard_stages in shard_runs:
+            timer.add(shard_stages, notes=f"summed over {len(shards)} workers")
+            results.extend(shard_results or [])
+            if shard_store is not None:
+                merged_store.update(shard_store)
+            if shard_stats is not None:
+                cache_stats = {name: (cache_stats or {}).get(name, 0) + count
+                               for name, count in shard_stats.items()}
+    if store is not None:
+        store.clear()
+        store.update(merged_store)
+    return results, cache_stats
+
+def update_html(results, site_dir=SITE_DIR, data_format='columnar', shards=True, timer=None):
+    """
+    Build the site: the page with the per-player summary embedded, data.json,
+    and (with shards) the per-player match shards the page fetches when a
+    player is expanded. Without shards every match is embedded in the page.
+
+    Data files are written under content-hashed names with gzip/brotli copies
+    and listed in manifest.json (see site_data.write_artifact); returns the
+    manifest's files. timer gets 'serialize' and 'embed' stages.
+    """
+    timer = timer or StageTimer()
     print("\nUpdating HTML...")
 
-    html_path = Path('/Users/MM/projects/tennis-analyzer/tennis_player_view-embedded.html')
-    html = html_path.read_text()
-
-    # Find and replace the data
-    import re
-    pattern = r'const MATCH_DATA = \[.*?\];'
-    json_data = json.dumps(data, separators=(',', ':'))
-    new_code = f'const MATCH_DATA = {json_data};'
-
-    html = re.sub(pattern, new_code, html, flags=re.DOTALL)
-    html_path.write_text(html)
-
-    print(f"  HTML updated: {len(data)} records, {len(html)/1024/1024:.1f}MB")
-
-def deploy():
-    """Deploy to Vercel"""
-    print("\nDeploying to Vercel...")
+    def encode(records):
+        if data_format == 'columnar':
+            return encode_columnar(records)
+        # NaN (e.g. a missing surface) is fine embedded in JS but not in a fetched JSON file
+        return [{key: None if value != value else value for key, value in record.items()} for record in records]
+
+    site_dir = Path(site_dir)
+    site_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+
+    with timer.stage('serialize', rows_in=len(results)) as stage:
+        summary = player_summary(results)
+        if shards:
+            for shard, records in shard_records(results).items():
+                files[SHARD_PATH.format(shard)] = write_artifact(site_dir, SHARD_PATH.format(shard), encode(records))
+            # The page fetches shards by their hashed names; None for buckets without players
+            summary['shards'] = [files.get(SHARD_PATH.format(shard), {}).get('path') for shard in range(SHARD_COUNT)]
+
+        all_data = encode(results)
+        files['data.json'] = write_artifact(site_dir, 'data.json', all_data)
+        write_json_atomic(site_dir / 'data.json', all_data)  # Stable name for anyone reading it directly
+        precompress_file(site_dir, 'data.json')  # Same content as the hashed copy, so not listed separately
+        stage.rows_out = summary['length']
+        stage.notes = 'rows out = summary rows'
+
+    # The page keeps its name (it's the entry point), so it's written once everything it references exists
+    with timer.stage('embed') as stage:
+        blocks = {'PLAYER_SUMMARY': summary, 'MATCH_DATA': None if shards else all_data}
+        html_size = embed_data(TEMPLATE_HTML, site_dir / TEMPLATE_HTML.name, blocks)
+        files[TEMPLATE_HTML.name] = precompress_file(site_dir, TEMPLATE_HTML.name)
+        write_manifest(site_dir, files)
+
+    data_size = files['data.json']['size']
+    print(f"  HTML updated: {len(results)} records, {html_size/1024/1024:.2f}MB (all data {data_size/1024/1024:.2f}MB)")
+    print(f"  {len(files)} artifacts in {site_dir / 'manifest.json'}")
+    return files
+
+def deploy(site_dir=SITE_DIR, command=DEPLOY_COMMAND):
+    """Deploy to Vercel (or whatever command says); returns whether it succeeded"""
+    print(f"\nDeploying ({command})...")
     result = subprocess.run(
-        ['npx', 'vercel', '--prod', '--yes'],
-        cwd='/Users/MM/projects/tennis-analyzer',
+        shlex.split(command),
+        cwd=site_dir,
         capture_output=True,
         text=True
     )
@@ -212,37 +451,131 @@ def deploy():
         print("  Deployed successfully!")
     else:
         print(f"  Deploy failed: {result.stderr}")
+    return result.returncode == 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pull latest ATP + WTA data, run analysis, rebuild site")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="worker processes for calculate_serve_advantage (default: 1)")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore stored results from previous runs and recompute everything")
+    parser.add_argument('--no-sim-cache', action='store_true',
+                        help="don't reuse simulations for identical serve counts")
+    parser.add_argument('--offline', action='store_true',
+                        help="use only previously downloaded CSVs, never touch the network")
+    parser.add_argument('--data-format', choices=('columnar', 'records'), default='columnar',
+                        help="site data layout: one array per field with string tables (default) "
+                             "or one object per match")
+    parser.add_argument('--site-dir', type=Path, default=SITE_DIR,
+                        help=f"where the built page and data.json are written and deployed from (default: {SITE_DIR})")
+    parser.add_argument('--no-shards', action='store_true',
+                        help="embed every match in the page instead of per-player shard files "
+                             "(larger, but works when opened from disk)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="build into a temporary directory and print what changed since the last deploy, "
+                             "without touching the site or deploying")
+    parser.add_argument('--deploy-cmd', default=DEPLOY_COMMAND,
+                        help=f"command run in the site directory to deploy it (default: {DEPLOY_COMMAND!r})")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"save the per-stage timings as JSON in {PROFILE_DIR}")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="also run under cProfile and save a .pstats file (implies --profile)")
+    parser.add_argument('--stacks', action='store_true',
+                        help="also sample Python stacks and save them collapsed for flamegraph.pl "
+                             "or speedscope (implies --profile)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    timer = StageTimer()
+    profiler = cProfile.Profile() if args.cprofile else None
+    sampler = StackSampler() if args.stacks else None
+    if sampler:
+        sampler.start()
+    if profiler:
+        profiler.enable()
+    try:
+        run(args, timer)
+    finally:
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.stop()
+        timer.print_summary()
+        if args.profile or profiler or sampler:
+            base = PROFILE_DIR / time.strftime('%Y%m%dT%H%M%S', time.localtime(timer.started))
+            timer.write_json(base.with_suffix('.json'))
+            print(f"\nProfile saved to {base.with_suffix('.json')}")
+            if profiler:
+                profiler.dump_stats(base.with_suffix('.pstats'))
+                print(f"  cProfile stats: {base.with_suffix('.pstats')}")
+            if sampler:
+                sampler.write(base.with_suffix('.folded'))
+                print(f"  Collapsed stacks: {base.with_suffix('.folded')}")
+
+def run(args, timer):
     print("="*60)
     print("TENNIS SERVE ANALYZER - DATA UPDATE")
     print("="*60)
 
     # Download ATP and WTA data
-    atp_df = download_tour_data('ATP')
-    wta_df = download_tour_data('WTA')
+    tour_frames = download_all_tours(('ATP', 'WTA'), offline=args.offline, timer=timer)
 
     # Combine
-    dfs = [df for df in [atp_df, wta_df] if df is not None]
+    dfs = [df for df in tour_frames.values() if df is not None]
     if not dfs:
         print("No data loaded!")
         sys.exit(1)
 
-    all_matches = pd.concat(dfs, ignore_index=True)
+    with timer.stage('parse'):
+        all_matches = concat_match_frames(dfs)
     print(f"\nTotal matches: {len(all_matches):,}")
+    # Measured on the combined frame the analysis holds, not the per-file frames
+    print(f"  {format_memory_saving([all_matches])}, before dropping matches without serve stats")
 
     # Calculate serve stats
-    results = calculate_serve_advantage(all_matches)
+    # Only new or changed performances are simulated; the rest come from the last run
+    store = {} if args.full else load_result_store(RESULT_STORE)
+    sim_cache_path = None if args.no_sim_cache else SIM_CACHE
+    results, cache_stats = calculate_serve_advantage_parallel(all_matches, args.jobs, store, sim_cache_path, timer)
+    # A dry run leaves the stored results as they were
+    if results is not None and not args.dry_run:
+        save_result_store(store, RESULT_STORE)
+    if cache_stats is not None:
+        print(f"  {format_cache_stats(cache_stats)}")
 
     # Filter out retirements
-    results = [r for r in results if not any(x in (r.get('sc') or '') for x in ['RET', 'W/O', 'DEF'])]
+    with timer.stage('filter', rows_in=len(results)) as stage:
+        results = [r for r in results if completed(r)]
+        stage.rows_out = len(results)
     print(f"\nFiltered results: {len(results):,}")
 
+    last_deploy = load_deploy_state(DEPLOY_STATE)
+    digests = record_digests(store)
+
+    if args.dry_run:
+        with tempfile.TemporaryDirectory() as build_dir:
+            files = update_html(results, build_dir, args.data_format, shards=not args.no_shards, timer=timer)
+        record_counts, changed_files = deploy_diff(last_deploy, files, digests)
+        print("\nDry run, not deploying:")
+        print_deploy_diff(record_counts, changed_files, files, last_deploy.get('files', {}))
+        return
+
     # Update HTML
-    update_html(results)
+    files = update_html(results, args.site_dir, args.data_format, shards=not args.no_shards, timer=timer)
 
-    # Deploy
-    deploy()
+    # Deploy, unless the artifacts are exactly what was deployed last time
+    record_counts, changed_files = deploy_diff(last_deploy, files, digests)
+    print_deploy_diff(record_counts, changed_files, files, last_deploy.get('files', {}))
+    if not changed_files and last_deploy.get('site_dir') == str(Path(args.site_dir).resolve()):
+        print("\nNothing changed since the last deploy, skipping it")
+    else:
+        with timer.stage('deploy') as stage:
+            deployed = deploy(args.site_dir, args.deploy_cmd)
+            stage.notes = None if deployed else 'failed'
+        if deployed:
+            save_deploy_state({'site_dir': str(Path(args.site_dir).resolve()), 'files': files, 'records': digests},
+                              DEPLOY_STATE)
 
     print("\nDone!")
 